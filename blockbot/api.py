@@ -7,12 +7,19 @@
     Update config/api.json to update credentials.
 '''
 
+import array
 import collections
-import dataclasses
+import concurrent.futures
+import enum
+import functools
 import json
 import os
+import re
+import requests
+import threading
 import time
 import tweepy
+import types
 import typing
 
 from . import path
@@ -32,40 +39,91 @@ START_PAGE = 0
 # Default timeout is set to 5 seconds.
 DEFAULT_TIMEOUT = 5
 
+# Default number of concurrent requests in flight for batched lookups.
+DEFAULT_POOL_SIZE = 4
+
+# Number of keep-alive connections per host: enough for the batched
+# lookup workers, a prefetching thread, and the main thread.
+HTTP_POOL_SIZE = DEFAULT_POOL_SIZE + 2
+
+# Major and minor version of Tweepy.
+TWEEPY_VERSION = tuple(int(i) for i in tweepy.__version__.split('.')[:2])
+
 
-@dataclasses.dataclass
 class IdState:
     '''Store current state for identifier.'''
-    max_id: typing.Optional[int] = START_MAX_ID
+
+    __slots__ = ('max_id',)
+
+    def __init__(self, max_id: typing.Optional[int] = START_MAX_ID) -> None:
+        self.max_id = max_id
+
+    def __repr__(self):
+        return f'IdState(max_id={self.max_id!r})'
 
 
-@dataclasses.dataclass
 class CursorState:
     '''Store current state for cursor.'''
-    next_cursor: int = START_CURSOR
+
+    __slots__ = ('next_cursor',)
+
+    def __init__(self, next_cursor: int = START_CURSOR) -> None:
+        self.next_cursor = next_cursor
+
+    def __repr__(self):
+        return f'CursorState(next_cursor={self.next_cursor!r})'
 
 
-@dataclasses.dataclass
 class PageState:
     '''Store current state for page.'''
-    current_page: int = START_PAGE
+
+    __slots__ = ('current_page',)
+
+    def __init__(self, current_page: int = START_PAGE) -> None:
+        self.current_page = current_page
+
+    def __repr__(self):
+        return f'PageState(current_page={self.current_page!r})'
 
 
 # ERRORS
 # ------
 
 
+class ErrorKind(enum.Enum):
+    '''Classification of a Tweepy error from its reason.'''
+    AUTHORIZATION = enum.auto()
+    CONNECTION = enum.auto()
+    OTHER = enum.auto()
+
+
+# Single pass over all the known error prefixes: the matched
+# group determines the kind of error.
+ERROR_PATTERN = re.compile(
+    r'(Not authorized\.|Twitter error response: status code = 401)'
+    r'|(Failed to send request: HTTPSConnectionPool)'
+)
+
+
+def classify_error(error):
+    '''Determine the kind of error from the error reason.'''
+
+    match = ERROR_PATTERN.match(error.reason)
+    if match is None:
+        return ErrorKind.OTHER
+    elif match.lastindex == 1:
+        return ErrorKind.AUTHORIZATION
+    return ErrorKind.CONNECTION
+
+
 def is_connection_error(error):
     '''Determine if an error is a connection error.'''
-    return error.reason.startswith('Failed to send request: HTTPSConnectionPool')
+    return classify_error(error) is ErrorKind.CONNECTION
 
 
 def is_authorization_error(error):
     '''Determine if an error is a authorization error.'''
-    return error.reason.startswith((
-        'Not authorized.',
-        'Twitter error response: status code = 401',
-    ))
+    return classify_error(error) is ErrorKind.AUTHORIZATION
 
 def is_user_not_found_error(error):
     '''Determine if the error is due to a user not being found.'''
@@ -90,19 +148,41 @@ class RateLimit:
     def __init__(self, limit, interval):
         self._limit = limit
         self._interval = interval
-        # This is a FIFO queue, where the left-most elements
-        # are the most recent aditions.
-        self._deque = collections.deque(maxlen=limit)
+        # This is a fixed-size ring buffer of packed call timestamps
+        # within the current window, where `_head` is the oldest call.
+        # Timestamps are monotonic, not wall-clock, so they are immune
+        # to clock adjustments but only meaningful within the process.
+        self._buffer = array.array('q', bytes(8 * limit))
+        self._head = 0
+        self._count = 0
+        # Calls may be made from prefetching threads, so serialize waits.
+        self._lock = threading.Lock()
+
+    def _popleft(self):
+        '''Remove and return the oldest call timestamp.'''
+
+        start = self._buffer[self._head]
+        self._head = (self._head + 1) % self._limit
+        self._count -= 1
+        return start
 
     def wait(self):
         '''Try to make a call, and if so, wait.'''
 
-        if len(self._deque) == self._limit:
-            start = self._deque.pop()
-            diff = time.time_ns() - start
-            wait_time = (self._interval - diff) / 10**9
-            time.sleep(max(wait_time, 0.0))
-        self._deque.appendleft(time.time_ns())
+        with self._lock:
+            # Evict all calls that have aged out of the sliding window.
+            cutoff = time.monotonic_ns() - self._interval
+            while self._count and self._buffer[self._head] <= cutoff:
+                self._popleft()
+
+            # Only sleep if the window is full, until the oldest call expires.
+            if self._count >= self._limit:
+                start = self._popleft()
+                wait_time = (start + self._interval - time.monotonic_ns()) / 10**9
+                time.sleep(max(wait_time, 0.0))
+            tail = (self._head + self._count) % self._limit
+            self._buffer[tail] = time.monotonic_ns()
+            self._count += 1
 
 
 # API
@@ -113,7 +193,7 @@ TimeLimit = collections.namedtuple('TimeLimit', 'limit interval')
 # These take the minimum for the current user or the app,
 # to ensure the limit isn't reached. They're adapted for
 # 15 minute windows, the original interval may be longer.
-API_V11_LIMITS = {
+API_V11_LIMITS = types.MappingProxyType({
     'update_status': TimeLimit(300, hours_to_ns(3)),
     'retweet': TimeLimit(300, hours_to_ns(3)),
     'create_favorite': TimeLimit(1000, hours_to_ns(24)),
@@ -127,6 +207,7 @@ API_V11_LIMITS = {
     'get_friend_ids': TimeLimit(15, minutes_to_ns(15)),
     'get_friends': TimeLimit(15, minutes_to_ns(15)),
     'get_friendship': TimeLimit(180, minutes_to_ns(15)),
+    'lookup_friendships': TimeLimit(15, minutes_to_ns(15)),
     'geo_id': TimeLimit(75, minutes_to_ns(15)),
     'supported_languages': TimeLimit(15, minutes_to_ns(15)),
     'get_lists': TimeLimit(15, minutes_to_ns(15)),
@@ -153,9 +234,9 @@ API_V11_LIMITS = {
     'lookup_users': TimeLimit(900, minutes_to_ns(15)),
     'search_users': TimeLimit(900, minutes_to_ns(15)),
     'get_user': TimeLimit(900, minutes_to_ns(15)),
-}
+})
 
-API_V2_LIMITS = {
+API_V2_LIMITS = types.MappingProxyType({
     'retweet': TimeLimit(300, hours_to_ns(3)),
     'unretweet': TimeLimit(1000, hours_to_ns(24)),
     'create_block': TimeLimit(50, minutes_to_ns(15)),
@@ -177,7 +258,25 @@ API_V2_LIMITS = {
     'destroy_friendship': TimeLimit(500, hours_to_ns(500)),
     'lookup_users': TimeLimit(900, minutes_to_ns(15)),
     'get_user': TimeLimit(900, minutes_to_ns(15)),
-}
+})
+
+# Version 2 API. Some of these still allow v1.1 access.
+API_V2_MERGED_LIMITS = types.MappingProxyType({**API_V11_LIMITS, **API_V2_LIMITS})
+
+# Sentinel for a rate limit that has not yet been constructed.
+MISSING = object()
+
+
+def get_limits_table(api_root):
+    '''Get the known rate limits for the API version.'''
+
+    if api_root in ('/1', '/1.1'):
+        # Version 1/1.1 API.
+        return API_V11_LIMITS
+    elif api_root == '/2':
+        # Version 2 API, falling back to version 1.1 limits.
+        return API_V2_MERGED_LIMITS
+    raise ValueError('Invalid API root version.')
 
 
 class API:
@@ -193,7 +292,7 @@ class API:
     if not provided, since recent versions of Tweepy have deprecated this.
     '''
 
-    _slots_ = ('api', 'api_root', 'local_rate_limit', 'limits')
+    _slots_ = ('api', 'api_root', 'local_rate_limit', 'limits', 'limits_table', 'lock')
 
     def __init__(self, api, api_root=None, local_rate_limit=False):
         self.api = api
@@ -201,61 +300,84 @@ class API:
         if api_root is None:
             self.api_root = getattr(api, 'api_root', '/1.1')
         self.local_rate_limit = local_rate_limit
+        # method: Optional[RateLimit], where None means no known limit.
         self.limits = {}
+        self.limits_table = None
+        # Guards the lazy construction of rate limiters across threads.
+        self.lock = threading.Lock()
+        if self.local_rate_limit:
+            self.limits_table = get_limits_table(self.api_root)
+        else:
+            # Let Tweepy do the heavy lifting.
+            self.wait_limit = self.wait_no_limit
+        self.bind_methods()
+
+    def bind_methods(self):
+        '''Bind public low-level methods without custom rate limits to the instance.'''
+
+        cls = type(self)
+        for name in dir(self.api):
+            if name.startswith('_') or hasattr(cls, name):
+                # Private, or has a wrapper with custom rate limits.
+                continue
+            attr = getattr(self.api, name, None)
+            if callable(attr):
+                setattr(self, name, attr)
 
     def wait_limit(self, method):
         '''Determine the appropriate wait for the current API version.'''
 
-        # Get our approach rate limit.
-        try:
-            if not self.local_rate_limit:
-                # Let Tweepy do the heavy lifting.
-                return
-            elif self.api_root in ('/1', '/1.1'):
-                # Version 1/1.1 API.
-                limit = API_V11_LIMITS[method]
-            elif self.api_root == '/2':
-                # Version 2 API. Some of these still allow v1.1 access.
-                limit = API_V2_LIMITS.get(method)
-                if limit is None:
-                    limit = API_V11_LIMITS[method]
-            else:
-                raise ValueError('Invalid API root version.')
-        except KeyError:
-            # No special known rate limits, just return.
-            return
+        # Construct our rate limiter on first use, and then wait.
+        with self.lock:
+            limit = self.limits.get(method, MISSING)
+            if limit is MISSING:
+                limit = self.limits[method] = self.new_limit(method)
+        if limit is not None:
+            limit.wait()
 
-        # Now, construct our rate limiter and wait.
-        if method not in self.limits:
-            self.limits[method] = RateLimit(limit.limit, limit.interval)
-        self.limits[method].wait()
+    def wait_no_limit(self, method):
+        '''Never wait, used in place of `wait_limit` without local rate limits.'''
 
-    def call(self, limit, names, *args, **kwds):
-        '''Call a Tweepy API method. Note that these endpoints might have aliases.'''
+    def new_limit(self, method):
+        '''Create a new rate limiter for the method, or None if it has no known limits.'''
+
+        limit = self.limits_table.get(method)
+        if limit is None:
+            return None
+        return RateLimit(limit.limit, limit.interval)
+
+    def resolve(self, names):
+        '''Find the low-level Tweepy method. Note that these endpoints might have aliases.'''
 
-        self.wait_limit(limit)
         # We might have renamed methods, iterate over those.
         for name in names:
             method = getattr(self.api, name, None)
             if method is not None:
-                return method(*args, **kwds)
+                return method
 
         raise ValueError('No suitable methods found.')
 
+    def call(self, limit, names, *args, **kwds):
+        '''Call a Tweepy API method. Note that these endpoints might have aliases.'''
+
+        self.wait_limit(limit)
+        return self.resolve(names)(*args, **kwds)
+
     def __getattr__(self, attr):
-        '''Fallback to call the proper low-level method if not provided.'''
+        '''Fallback to get the low-level attribute if not provided or bound.'''
         return getattr(self.api, attr)
 
     def user_timeline(self, *args, **kwds):
         return self.call('user_timeline', ['user_timeline'], *args, **kwds)
 
-    user_timeline.pagination_mode = 'id'
-
     # User methods
 
     def get_user(self, *args, **kwds):
         return self.call('get_user', ['get_user'], *args, **kwds)
 
+    def lookup_users(self, *args, **kwds):
+        return self.call('lookup_users', ['lookup_users'], *args, **kwds)
+
     def me(self):
         # Removed in Tweepy 4.0
         return self.get_user(screen_name=self.api.auth.get_username())
@@ -264,7 +386,13 @@ class API:
         names = ['get_followers', 'followers']
         return self.call('get_followers', names, *args, **kwds)
 
-    get_followers.pagination_mode = 'cursor'
+    def get_follower_ids(self, *args, **kwds):
+        names = ['get_follower_ids', 'followers_ids']
+        return self.call('get_follower_ids', names, *args, **kwds)
+
+    def get_friend_ids(self, *args, **kwds):
+        names = ['get_friend_ids', 'friends_ids']
+        return self.call('get_friend_ids', names, *args, **kwds)
 
     # Friendship Methods
 
@@ -272,6 +400,9 @@ class API:
         names = ['get_friendship', 'show_friendship']
         return self.call('get_friendship', names, *args, **kwds)
 
+    def lookup_friendships(self, *args, **kwds):
+        return self.call('lookup_friendships', ['lookup_friendships'], *args, **kwds)
+
     # Account Methods
 
     def verify_credentials(self, *args, **kwds):
@@ -298,7 +429,13 @@ class API:
         names = ['search_tweets', 'search']
         return self.call('search_tweets', names, *args, **kwds)
 
-    search_tweets.pagination_mode = 'id'
+
+@functools.lru_cache(maxsize=1)
+def load_config():
+    '''Read the API configuration file, only once per process.'''
+
+    with open(os.path.join(path.config_dir(), 'api.json')) as f:
+        return json.load(f)
 
 
 def generate_api(
@@ -308,8 +445,7 @@ def generate_api(
 ):
     '''Generate the API from config.'''
 
-    with open(os.path.join(path.config_dir(), 'api.json')) as f:
-        api_data = json.load(f)
+    api_data = load_config()
 
     consumer_key = api_data['consumer_key']
     consumer_secret = api_data['consumer_secret']
@@ -323,31 +459,97 @@ def generate_api(
     if local_rate_limit is None:
         local_rate_limit = api_data.get('local_rate_limit', False)
 
+    options = {}
+    if TWEEPY_VERSION < (4,):
+        # Removed in Tweepy 4.0: requests always asks for gzip.
+        options['wait_on_rate_limit_notify'] = True
+        options['compression'] = True
     tweepy_api = tweepy.API(
         auth,
         timeout=timeout,
         wait_on_rate_limit=True,
-        wait_on_rate_limit_notify=True,
-        compression=True
+        **options
     )
+
+    # Tweepy 4.0+ re-uses a single session: keep enough connections
+    # alive for all concurrent requests, so none are discarded and
+    # re-established with a new TLS handshake.
+    session = getattr(tweepy_api, 'session', None)
+    if session is not None:
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=DEFAULT_POOL_SIZE,
+            pool_maxsize=HTTP_POOL_SIZE,
+        )
+        session.mount('https://', adapter)
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+
     return API(tweepy_api, api_root, local_rate_limit)
 
 
+def paginate_cursor(method, cursor_state, next_cursor, **kwds):
+    '''
+    Yield pages from a cursor-paginated API method.
+
+    :param method: Bound API method, which returns (page, (previous, next)).
+    :param cursor_state: (Optional) Current cursor state of iterator.
+    :param next_cursor: Cursor to start iterating from.
+    '''
+
+    while next_cursor != END_CURSOR:
+        page, (_, next_cursor) = method(cursor=next_cursor, **kwds)
+        yield page
+
+        # Increment state after fetching page.
+        if cursor_state is not None:
+            cursor_state.next_cursor = next_cursor
+
+
+def paginate_id(method, id_state, max_id, **kwds):
+    '''
+    Yield pages from an ID-paginated API method.
+
+    :param method: Bound API method, which returns a list of items with IDs.
+    :param id_state: (Optional) Current id state of iterator.
+    :param max_id: Max ID to start iterating from, or None for the newest items.
+    '''
+
+    while True:
+        page = method(max_id=max_id, **kwds)
+        if not page:
+            return
+        yield page
+
+        # Increment state after fetching page. The next page
+        # starts just below the smallest ID seen.
+        max_id = min(item.id for item in page) - 1
+        if id_state is not None:
+            id_state.max_id = max_id
+
+
 def lookup_users(
     api,
     user_ids=None,
     screen_names=None,
     page_state=None,
     logger=None,
+    pool_size=DEFAULT_POOL_SIZE,
+    **kwds
 ):
     '''
     Lookup user accounts. Must provide `user_ids` or `screen_names`.
 
+    Up to `pool_size` requests are kept in flight at once, to overlap
+    network latency, but users are always yielded in request order.
+
     :param api: Tweepy API instance.
     :param user_ids: (Optional) Iterable of user IDs.
     :param screen_names: (Optional) Iterable of screen names.
     :param page_state: (Optional) Current page state of iterator.
     :param logger: (Optional) Log file to record data to.
+    :param pool_size: (Optional) Maximum number of concurrent requests.
+    :param **kwds:
+        Optional keyword-arguments to pass to each request, such
+        as `include_entities=False` to omit unused entities.
 
     .. code-block:: python
 
@@ -365,15 +567,29 @@ def lookup_users(
     # Constants
     page_size = 100
 
+    def fetch(future):
+        yield from future.result()
+
+        # Increment state after fetching users.
+        if page_state is not None:
+            page_state.current_page += 1
+
     def bind_api(param, iterable, current_page):
         start_index = current_page * page_size
-        for chunk in util.chunks(iterable, page_size, start_index):
-            for user in api.lookup_users(**{param: chunk}):
-                yield user
-
-            # Increment state after fetching users.
-            if page_state is not None:
-                page_state.current_page += 1
+        method = api.resolve(['lookup_users'])
+        # FIFO queue of pending requests, to preserve ordering.
+        pending = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=pool_size) as executor:
+            for chunk in util.chunks(iterable, page_size, start_index):
+                # Wait on the rate limit before submitting, so the limiter
+                # sees the time the request was issued, not completed.
+                api.wait_limit('lookup_users')
+                pending.append(executor.submit(method, **{param: chunk}, **kwds))
+                if len(pending) >= pool_size:
+                    yield from fetch(pending.popleft())
+
+            while pending:
+                yield from fetch(pending.popleft())
 
     # Can handle up to 100 users per request.
     current_page = START_PAGE
@@ -427,19 +643,15 @@ def get_followers(
     if logger is not None:
         logger.info(f'Calling Twitter API.followers.')
 
-    cursor = tweepy.Cursor(
-        api.get_followers,
-        user_id=user_id,
-        screen_name=screen_name,
-        cursor=next_cursor,
-    )
     try:
-        for page in cursor.pages():
+        for page in paginate_cursor(
+            api.get_followers,
+            cursor_state,
+            next_cursor,
+            user_id=user_id,
+            screen_name=screen_name,
+        ):
             yield from page
-
-            # Increment state after fetching followers.
-            if cursor_state is not None:
-                cursor_state.next_cursor = cursor.iterator.next_cursor
     except tweepy.TweepError as error:
         if is_authorization_error(error):
             if logger is not None:
@@ -450,6 +662,110 @@ def get_followers(
             raise
 
 
+def get_follower_ids(
+    api,
+    user_id=None,
+    screen_name=None,
+    cursor_state=None,
+    logger=None,
+):
+    '''
+    Get pages of follower IDs of account.
+
+    Each page holds up to 5000 IDs, rather than the 200 users
+    returned by `get_followers`, so this is far cheaper when the
+    full user objects are not needed for every follower.
+
+    :param api: Tweepy API instance.
+    :param user_ids: (Optional) User IDs.
+    :param screen_names: (Optional) Screen name.
+    :param cursor_state: (Optional) Current cursor state of iterator.
+    :param logger: (Optional) Log file to record data to.
+
+    .. code-block:: python
+
+        api = generate_api()
+        screen_name = 'twitter'
+        cursor_state = CursorState()
+        for ids in get_follower_ids(
+            api,
+            screen_name=screen_name,
+            cursor_state=cursor_state
+        ):
+            print(len(ids))
+    '''
+
+    next_cursor = START_CURSOR
+    if cursor_state is not None:
+        next_cursor = cursor_state.next_cursor
+
+    if logger is not None:
+        logger.info(f'Calling Twitter API.followers_ids.')
+
+    try:
+        yield from paginate_cursor(
+            api.get_follower_ids,
+            cursor_state,
+            next_cursor,
+            user_id=user_id,
+            screen_name=screen_name,
+            count=5000,
+        )
+    except tweepy.TweepError as error:
+        if is_authorization_error(error):
+            if logger is not None:
+                logger.warn(f'Unauthorized to get follower IDs for account user_id={user_id}, screen_name={screen_name}.')
+        else:
+            # Only expect authorization errors, due to user blocking/protected
+            # status. Raise all errors.
+            raise
+
+
+def get_friend_ids(
+    api,
+    user_id=None,
+    screen_name=None,
+    cursor_state=None,
+    logger=None,
+):
+    '''
+    Get pages of IDs of accounts followed by account.
+
+    Each page holds up to 5000 IDs.
+
+    :param api: Tweepy API instance.
+    :param user_ids: (Optional) User IDs.
+    :param screen_names: (Optional) Screen name.
+    :param cursor_state: (Optional) Current cursor state of iterator.
+    :param logger: (Optional) Log file to record data to.
+    '''
+
+    next_cursor = START_CURSOR
+    if cursor_state is not None:
+        next_cursor = cursor_state.next_cursor
+
+    if logger is not None:
+        logger.info(f'Calling Twitter API.friends_ids.')
+
+    try:
+        yield from paginate_cursor(
+            api.get_friend_ids,
+            cursor_state,
+            next_cursor,
+            user_id=user_id,
+            screen_name=screen_name,
+            count=5000,
+        )
+    except tweepy.TweepError as error:
+        if is_authorization_error(error):
+            if logger is not None:
+                logger.warn(f'Unauthorized to get friend IDs for account user_id={user_id}, screen_name={screen_name}.')
+        else:
+            # Only expect authorization errors, due to user blocking/protected
+            # status. Raise all errors.
+            raise
+
+
 def user_timeline(
     api,
     user_id=None,
@@ -486,19 +802,15 @@ def user_timeline(
     if logger is not None:
         logger.info(f'Calling Twitter API.user_timeline.')
 
-    cursor = tweepy.Cursor(
-        api.user_timeline,
-        user_id=user_id,
-        screen_name=screen_name,
-        max_id=max_id,
-    )
     try:
-        for page in cursor.pages():
+        for page in paginate_id(
+            api.user_timeline,
+            id_state,
+            max_id,
+            user_id=user_id,
+            screen_name=screen_name,
+        ):
             yield from page
-
-            # Increment state after fetching user timeline.
-            if id_state is not None:
-                id_state.max_id = cursor.iterator.max_id
     except tweepy.TweepError as error:
         if is_authorization_error(error):
             if logger is not None:
@@ -544,6 +856,23 @@ def search_tweets(
             print(tweet.id)
     '''
 
+    for page in search_tweet_pages(api, query, logger, id_state, **kwds):
+        yield from page
+
+
+def search_tweet_pages(
+    api,
+    query,
+    logger=None,
+    id_state=None,
+    **kwds
+):
+    '''
+    Perform Twitter search, yielding pages of Tweets.
+
+    Accepts the same arguments as `search_tweets`.
+    '''
+
     max_id = START_MAX_ID
     if id_state is not None:
         max_id = id_state.max_id
@@ -551,28 +880,53 @@ def search_tweets(
     if logger is not None:
         logger.info(f'Calling Twitter API.search_tweets.')
 
-    cursor = tweepy.Cursor(
+    # Cannot error except for a network error.
+    yield from paginate_id(
         api.search_tweets,
+        id_state,
+        max_id,
         q=query,
-        max_id=max_id,
         **kwds
     )
-    # Cannot error except for a network error.
-    for page in cursor.pages():
-        yield from page
 
-        # Increment state after search results.
-        if id_state is not None:
-            id_state.max_id = cursor.iterator.max_id
 
+def lookup_friendships(api, user_ids):
+    '''
+    Lookup the relationships of the authenticated user with other users.
 
-def create_block(api, user_id):
-    '''Try and create a block for a given user.'''
+    Up to 100 users are looked up per request.
 
-    try:
-        api.create_block(user_id=user_id)
-    except tweepy.TweepError as error:
-        if is_user_not_found_error(error):
-            # Use deactivated their account while processing.
-            return
-        raise
+    :param api: Tweepy API instance.
+    :param user_ids: Iterable of user IDs.
+    '''
+
+    # Renamed in Tweepy 4.0.
+    param = 'user_ids' if TWEEPY_VERSION < (4,) else 'user_id'
+    for chunk in util.chunks(user_ids, 100):
+        yield from api.lookup_friendships(**{param: chunk})
+
+
+def create_blocks(api, user_ids, pool_size=DEFAULT_POOL_SIZE):
+    '''
+    Try and create blocks for many users, with concurrent requests.
+
+    :param api: Tweepy API instance.
+    :param user_ids: Iterable of user IDs to block.
+    :param pool_size: (Optional) Maximum number of concurrent requests.
+    '''
+
+    method = api.resolve(['create_block'])
+    with concurrent.futures.ThreadPoolExecutor(max_workers=pool_size) as executor:
+        futures = []
+        for user_id in user_ids:
+            # Wait on the rate limit before submitting, so the limiter
+            # sees the time the request was issued, not completed.
+            api.wait_limit('create_block')
+            futures.append(executor.submit(method, user_id=user_id))
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except tweepy.TweepError as error:
+                if not is_user_not_found_error(error):
+                    raise
@@ -15,6 +15,11 @@
     continue an interrupted query with minimal overhead. Only whitelist
     a small number of users.
 
+    Accounts are processed sequentially: the follower rate limits apply
+    to the credentials in `api.json`, so enumerating several accounts at
+    once with the same credentials would not process followers any
+    faster. User lookups are still issued concurrently within an account.
+
     # Sample Use
 
     .. code-block:: python
@@ -26,11 +31,13 @@
         blockbot.block_followers(account_screen_names, whitelist_screen_names)
 '''
 
+import contextlib
 import tweepy
 
 from . import api
 from . import collections
 from . import log
+from . import util
 from . import whitelist
 
 # Logger for BlockFollowers.
@@ -39,27 +46,29 @@ LOGGER = log.new_logger('BlockFollowers')
 ACCOUNTS_PROCESSED = collections.sqlite_dict(
     table='block_followers_processed_accounts',
     columns=(
-        ('user_id', 'TEXT', False),
+        ('user_id', 'INTEGER', False),
         ('screen_name', 'TEXT', False),
         ('cursor', 'TEXT', True),
     ),
     primary_key='user_id',
+    indexes=(('screen_name', False),),
 )
 # Previously seen account screen names.
 FOLLOWERS_SEEN = collections.sqlite_dict(
     table='block_followers_seen_followers',
     columns=(
-        ('user_id', 'TEXT', False),
+        ('user_id', 'INTEGER', False),
         ('screen_name', 'TEXT', False),
     ),
     primary_key='user_id',
+    cache_size=100000,
 )
 # Previously blocked account screen names.
 FOLLOWERS_BLOCKED = collections.sqlite_dict(
     table='block_followers_blocked_followers',
     columns=(
         # Basic Follower Info
-        ('follower_id', 'TEXT', False),
+        ('follower_id', 'INTEGER', False),
         ('follower_screen_name', 'TEXT', False),
         # Booleans.
         ('follower_default_profile', 'INTEGER', False),
@@ -81,99 +90,160 @@ FOLLOWERS_BLOCKED = collections.sqlite_dict(
         ('follower_withheld_in_countries', 'TEXT', False),
         ('follower_withheld_scope', 'TEXT', False),
         # Basic Account Info
-        ('account_id', 'TEXT', False),
+        ('account_id', 'INTEGER', False),
         ('account_screen_name', 'TEXT', False),
     ),
     primary_key='follower_id',
 )
 
 def followers(tweepy_api, account):
-    '''Get user objects for all followers of account.'''
+    '''
+    Get pages of user objects for all unseen followers of account.
+
+    Only follower IDs are paginated, and user objects are only
+    looked up for followers that have not been previously seen.
+    Each page contains the unseen followers from a single page of IDs.
+    '''
 
     # Get the current cursor for the account.
     cursor_state = api.CursorState()
-    previous = ACCOUNTS_PROCESSED.get(str(account.id))
+    previous = ACCOUNTS_PROCESSED.get(account.id)
     if previous is not None:
         cursor_state.next_cursor = int(previous['cursor'])
     if cursor_state.next_cursor == api.END_CURSOR:
         # Previously finished the account, don't make any API requests.
         return
 
-    try:
-        count = 0
-        for follower in api.get_followers(
+    def pages():
+        # Pair each page with its cursor, since the cursor state is
+        # advanced by the prefetching thread.
+        for ids in api.get_follower_ids(
             tweepy_api,
             user_id=account.id,
             cursor_state=cursor_state,
             logger=LOGGER,
         ):
-            count += 1
-            if count % 50 == 0 and count > 0:
+            yield (cursor_state.next_cursor, ids)
+
+    # Cursor of the page being processed, or None between pages.
+    current_cursor = None
+    try:
+        count = 0
+        # Fetch the next page of IDs while the current page is processed.
+        for (cursor, ids) in util.prefetch(pages()):
+            current_cursor = cursor
+            # The previous page has been processed and committed, so
+            # checkpoint the cursor for the current page. An interrupted
+            # run resumes here, rather than from the start of the account.
+            ACCOUNTS_PROCESSED[account.id] = {
+                'screen_name': account.screen_name,
+                'cursor': str(cursor),
+            }
+            seen = FOLLOWERS_SEEN.contains_keys(ids)
+            unseen = [i for i in ids if i not in seen]
+            if unseen:
+                page = list(api.lookup_users(
+                    tweepy_api,
+                    user_ids=unseen,
+                    include_entities=False,
+                ))
+                count += len(page)
                 LOGGER.info(f'Processed {count} followers.')
-            yield follower
+                yield page
+            current_cursor = None
     except tweepy.TweepError:
-        # Store the cursor state on an error and re-raise.
-        ACCOUNTS_PROCESSED[str(account.id)] = {
+        # Store the cursor state on an error and re-raise. If we failed
+        # while processing a page, resume from that page, otherwise we
+        # failed fetching the next page.
+        if current_cursor is None:
+            current_cursor = cursor_state.next_cursor
+        ACCOUNTS_PROCESSED[account.id] = {
             'screen_name': account.screen_name,
-            'cursor': str(cursor_state.next_cursor),
+            'cursor': str(current_cursor),
         }
         raise
 
     # Store that all followers have been processed for account.
-    ACCOUNTS_PROCESSED[str(account.id)] = {
+    ACCOUNTS_PROCESSED[account.id] = {
         'screen_name': account.screen_name,
         'cursor': str(api.END_CURSOR),
     }
 
 
-def block_follower(tweepy_api, me, account, follower, whitelist_users, **kwds):
-    '''Block account if not white-listed.'''
+def is_account_processed(screen_name):
+    '''Check if all followers of an account were previously processed.'''
 
-    # Allow repeated requests without incurring API limits.
-    if str(follower.id) in FOLLOWERS_SEEN:
-        LOGGER.info(f'Already blocked follower={follower.screen_name}')
-        return
+    item = ACCOUNTS_PROCESSED.get_by_column('screen_name', screen_name)
+    return item is not None and int(item[1]['cursor']) == api.END_CURSOR
+
+
+def memoize_blocked(account, follower):
+    '''Memoize a blocked follower.'''
+
+    LOGGER.info(f'Blocked follower={follower.screen_name}')
+    # Very few accounts are withheld, so avoid joining an empty list.
+    withheld_countries = getattr(follower, 'withheld_in_countries', None)
+    withheld_countries = ','.join(withheld_countries) if withheld_countries else ''
+    withheld_scope = getattr(follower, 'withheld_scope', '')
+    FOLLOWERS_BLOCKED[follower.id] = (
+        # Basic Follower Info
+        follower.screen_name,
+        # Booleans
+        int(follower.default_profile),
+        int(follower.default_profile_image),
+        int(follower.protected),
+        int(follower.verified),
+        # Numbers
+        follower.favourites_count,
+        follower.followers_count,
+        follower.friends_count,
+        follower.listed_count,
+        follower.statuses_count,
+        # Strings
+        str(follower.created_at),
+        follower.description or '',
+        follower.location or '',
+        follower.name,
+        follower.url or '',
+        withheld_countries,
+        withheld_scope,
+        # Basic Account Info
+        account.id,
+        account.screen_name,
+    )
 
-    if whitelist.should_block_user(tweepy_api, me, follower, whitelist_users, **kwds):
-        if not getattr(follower, 'blocking', False):
-            api.create_block(tweepy_api, follower.id)
-
-        # Memoize blocked account.
-        LOGGER.info(f'Blocked follower={follower.screen_name}')
-        withheld_countries = ','.join(getattr(follower, 'withheld_in_countries', []))
-        FOLLOWERS_BLOCKED[str(follower.id)] = {
-            # Basic Follower Info
-            'follower_screen_name': follower.screen_name,
-            # Booleans
-            'follower_default_profile': int(follower.default_profile),
-            'follower_default_profile_image': int(follower.default_profile_image),
-            'follower_protected': int(follower.protected),
-            'follower_verified': int(follower.verified),
-            # Numbers
-            'follower_favourites_count': follower.favourites_count,
-            'follower_followers_count': follower.followers_count,
-            'follower_friends_count': follower.friends_count,
-            'follower_listed_count': follower.listed_count,
-            'follower_statuses_count': follower.statuses_count,
-            # Strings
-            'follower_created_at': str(follower.created_at),
-            'follower_description': follower.description or '',
-            'follower_location': follower.location or '',
-            'follower_name': follower.name,
-            'follower_url': follower.url or '',
-            'follower_withheld_in_countries': withheld_countries,
-            'follower_withheld_scope': getattr(follower, 'withheld_scope', ''),
-            # Basic Account Info
-            'account_id': str(account.id),
-            'account_screen_name': account.screen_name,
-        }
 
-    # Memoize seen account.
-    FOLLOWERS_SEEN[str(follower.id)] = {
+def memoize_seen(follower):
+    '''Memoize a seen follower.'''
+
+    FOLLOWERS_SEEN[follower.id] = {
         'screen_name': follower.screen_name,
     }
 
 
+def block_follower_batch(tweepy_api, me, account, followers, whitelist_users, **kwds):
+    '''
+    Block all accounts in a batch that are not white-listed.
+
+    Block requests for the batch are issued concurrently, rather
+    than waiting on each request in turn.
+    '''
+
+    seen = FOLLOWERS_SEEN.contains_keys(i.id for i in followers)
+    for follower in followers:
+        if follower.id in seen:
+            LOGGER.info(f'Already blocked follower={follower.screen_name}')
+    followers = [i for i in followers if i.id not in seen]
+    blocked = whitelist.should_block_users(tweepy_api, me, followers, whitelist_users, **kwds)
+    user_ids = [i.id for i in blocked if not getattr(i, 'blocking', False)]
+    api.create_blocks(tweepy_api, user_ids)
+
+    for follower in blocked:
+        memoize_blocked(account, follower)
+    for follower in followers:
+        memoize_seen(follower)
+
+
 def block_followers(
     account_screen_names,
     whitelist_screen_names=None,
@@ -202,22 +272,44 @@ def block_followers(
     timeout = kwds.pop('timeout', api.DEFAULT_TIMEOUT)
     api_root = kwds.pop('api_root', None)
     local_rate_limit = kwds.pop('local_rate_limit', None)
+    # Skip accounts that were fully processed, without any API calls.
+    account_screen_names = list(account_screen_names)
+    pending_screen_names = [
+        i for i in account_screen_names
+        if not is_account_processed(i)
+    ]
+    if not pending_screen_names:
+        LOGGER.info('All accounts were previously processed.')
+        return
+    if len(pending_screen_names) != len(account_screen_names):
+        # The page state indexes into the full list of screen names.
+        account_page_state = None
+
     tweepy_api = api.generate_api(timeout, api_root, local_rate_limit)
     me = tweepy_api.me()
     accounts = api.lookup_users(
         tweepy_api,
-        screen_names=account_screen_names,
+        screen_names=pending_screen_names,
         page_state=account_page_state,
         logger=LOGGER,
     )
-    whitelist = []
+    whitelist_users = []
     if whitelist_screen_names is not None:
-        whitelist = list(api.lookup_users(
+        whitelist_users = list(api.lookup_users(
             tweepy_api,
             screen_names=whitelist_screen_names,
             logger=LOGGER,
         ))
+        # Fetch friendships with whitelisted accounts once, up front,
+        # and order the whitelist to check the cheapest accounts first.
+        whitelist_users = whitelist.prefetch_whitelist(tweepy_api, whitelist_users)
 
     for account in accounts:
-        for follower in followers(tweepy_api, account):
-            block_follower(tweepy_api, me, account, follower, whitelist, **kwds)
+        # Close the pages on an error, so the prefetching thread stops
+        # before the error is handled, rather than when it is collected.
+        with contextlib.closing(followers(tweepy_api, account)) as pages:
+            for page in pages:
+                # Commit each page in a single transaction, keeping any
+                # progress made before an error.
+                with FOLLOWERS_SEEN.transaction(rollback=False):
+                    block_follower_batch(tweepy_api, me, account, page, whitelist_users, **kwds)
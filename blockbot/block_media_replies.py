@@ -26,23 +26,41 @@
         blockbot.block_media_replies(account_screen_name, whitelist_screen_names)
 '''
 
-import os
+import contextlib
+import itertools
 import tweepy
 
 from . import api
 from . import collections
 from . import log
+from . import util
 from . import whitelist
 
 # Logger for BlockMediaReply.
 LOGGER = log.new_logger('BlockMediaReplies')
+# Number of replies to process in a single transaction.
+BATCH_SIZE = 200
+# Maximum number of consecutive Tweets to search for replies at once.
+SEARCH_GROUP_SIZE = 5
+# Photo MIME types by file extension.
+PHOTO_MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.png': 'image/png',
+}
+# Recognized video MIME types.
+VIDEO_TYPES = frozenset({
+    'video/quicktime',
+    'video/mp4',
+})
 # Previously processed tweets from account.
 TWEETS_PROCESSED = collections.sqlite_dict(
     table='block_media_replies_processed_tweets',
     columns=(
-        ('user_id', 'TEXT', False),
+        ('user_id', 'INTEGER', False),
         ('screen_name', 'TEXT', False),
-        ('max_id', 'TEXT', True),
+        ('max_id', 'INTEGER', True),
     ),
     primary_key='user_id',
 )
@@ -50,8 +68,8 @@ TWEETS_PROCESSED = collections.sqlite_dict(
 REPLIES_PROCESSED = collections.sqlite_dict(
     table='block_media_replies_processed_replies',
     columns=(
-        ('tweet_id', 'TEXT', False), # Original Tweet ID
-        ('max_id', 'TEXT', True),    # Max ID for the replies.
+        ('tweet_id', 'INTEGER', False), # Original Tweet ID
+        ('max_id', 'INTEGER', True), # Max ID for the replies.
     ),
     primary_key='tweet_id',
 )
@@ -59,19 +77,20 @@ REPLIES_PROCESSED = collections.sqlite_dict(
 REPLIERS_SEEN = collections.sqlite_dict(
     table='block_followers_seen_repliers',
     columns=(
-        ('user_id', 'TEXT', False),
+        ('user_id', 'INTEGER', False),
         ('screen_name', 'TEXT', False),
     ),
     primary_key='user_id',
+    cache_size=100000,
 )
 # Previously blocked account screen names of replier.
 REPLIERS_BLOCKED = collections.sqlite_dict(
     table='block_media_replies_blocked_repliers',
     columns=(
         # Basic Replier Info
-        ('replier_id', 'TEXT', False),
+        ('replier_id', 'INTEGER', False),
         ('replier_screen_name', 'TEXT', False),
-        ('reply_id', 'TEXT', False),
+        ('reply_id', 'INTEGER', False),
         # Replier Booleans.
         ('replier_default_profile', 'INTEGER', False),
         ('replier_default_profile_image', 'INTEGER', False),
@@ -92,8 +111,8 @@ REPLIERS_BLOCKED = collections.sqlite_dict(
         ('replier_withheld_in_countries', 'TEXT', False),
         ('replier_withheld_scope', 'TEXT', False),
         # Basic Tweet Info
-        ('tweet_id', 'TEXT', False),
-        ('tweet_author_id', 'TEXT', False),
+        ('tweet_id', 'INTEGER', False),
+        ('tweet_author_id', 'INTEGER', False),
         ('tweet_author_screen_name', 'TEXT', False),
         # Reply Booleans
         ('reply_is_quote_status', 'INTEGER', False),
@@ -114,6 +133,8 @@ REPLIERS_BLOCKED = collections.sqlite_dict(
         ('media_url', 'TEXT', False),           # CSV-delimited if multiple values
     ),
     primary_key='replier_id',
+    # REPLIERS_SEEN decides if a replier was processed, so never rewrite rows.
+    insert_ignore=True,
 )
 
 
@@ -122,9 +143,9 @@ def tweets(tweepy_api, account):
 
     # Get the current max_id for the tweets from account.
     id_state = api.IdState()
-    previous = TWEETS_PROCESSED.get(str(account.id))
+    previous = TWEETS_PROCESSED.get(account.id)
     if previous is not None:
-        id_state.max_id = int(previous['max_id'])
+        id_state.max_id = previous['max_id']
     if id_state.max_id == api.END_MAX_ID:
         # Previously finished all Tweets from account, don't make any API requests.
         return
@@ -140,60 +161,135 @@ def tweets(tweepy_api, account):
             yield tweet
     except tweepy.TweepError:
         # Store the id state on an error and re-raise.
-        TWEETS_PROCESSED[str(account.id)] = {
+        TWEETS_PROCESSED[account.id] = {
             'screen_name': account.screen_name,
-            'max_id': str(id_state.max_id),
+            'max_id': id_state.max_id,
         }
         raise
 
     # Store that all Tweets have been processed for account.
-    TWEETS_PROCESSED[str(account.id)] = {
+    TWEETS_PROCESSED[account.id] = {
         'screen_name': account.screen_name,
-        'max_id': str(api.END_MAX_ID),
+        'max_id': api.END_MAX_ID,
     }
 
 
-def replies(tweepy_api, tweet, previous_id=None):
-    '''Find replies to Tweet.'''
+def tweet_groups(tweets, processed_tweets, finished_tweets):
+    '''
+    Group consecutive Tweets whose replies can be found in a single search.
+
+    Yields pairs of the previous Tweet ID and a list of Tweets, from
+    newest to oldest. Finished Tweets are skipped, and partially
+    processed Tweets are searched alone, so they resume from their
+    stored state.
+
+    :param processed_tweets: IDs of Tweets with any stored search state.
+    :param finished_tweets: IDs of Tweets with all replies processed.
+    '''
+
+    previous_id = None
+    group = []
+    try:
+        for tweet in tweets:
+            if tweet.id in processed_tweets:
+                if group:
+                    yield (previous_id, group)
+                    previous_id = group[-1].id
+                    group = []
+                if tweet.id not in finished_tweets:
+                    yield (previous_id, [tweet])
+                previous_id = tweet.id
+                continue
+            group.append(tweet)
+            if len(group) == SEARCH_GROUP_SIZE:
+                yield (previous_id, group)
+                previous_id = tweet.id
+                group = []
+    except tweepy.TweepError:
+        # Search the Tweets fetched before the error, since the stored
+        # timeline state has already moved past them.
+        if group:
+            yield (previous_id, group)
+        raise
+
+    if group:
+        yield (previous_id, group)
+
+
+def memoize_replies_state(tweets, previous_id, max_id):
+    '''
+    Memoize the search state for a group of Tweets.
+
+    Each Tweet covers the replies posted after it, up to the previous
+    Tweet, and all replies above `max_id` have been processed.
+    '''
+
+    if max_id == api.START_MAX_ID:
+        return
+    upper_id = previous_id
+    for tweet in tweets:
+        if max_id <= tweet.id:
+            REPLIES_PROCESSED[tweet.id] = {
+                'max_id': api.END_MAX_ID,
+            }
+        elif upper_id is None or max_id < upper_id:
+            REPLIES_PROCESSED[tweet.id] = {
+                'max_id': max_id,
+            }
+        upper_id = tweet.id
+
+
+def replies(tweepy_api, tweets, previous_id=None):
+    '''
+    Find replies to a group of consecutive Tweets, from newest to oldest.
+
+    Replies to all Tweets in the group are found in a single search,
+    and each reply is yielded with the newest Tweet posted before it.
+    '''
 
     id_state = api.IdState()
-    previous = REPLIES_PROCESSED.get(str(tweet.id))
+    previous = REPLIES_PROCESSED.get(tweets[0].id)
     if previous is not None:
-        id_state.max_id = int(previous['max_id'])
+        id_state.max_id = previous['max_id']
     if id_state.max_id == api.END_MAX_ID:
         # Previously finished all replies to the tweet, don't make any API requests.
         return
 
     # Build our query and fetch Tweets.
-    LOGGER.info(f'Finding replies to Tweet id {tweet.id}.')
-    query = f'to:{tweet.user.screen_name} filter:media since_id:{tweet.id}'
+    tweet_ids = ', '.join(str(i.id) for i in tweets)
+    LOGGER.info(f'Finding replies to Tweet ids {tweet_ids}.')
+    screen_name = tweets[0].user.screen_name
+    query = f'to:{screen_name} filter:media since_id:{tweets[-1].id}'
     if previous_id is not None:
         query += f' max_id:{previous_id}'
+    pages = api.search_tweet_pages(
+        tweepy_api,
+        query,
+        count=100,
+        result_type='recent',
+        id_state=id_state,
+        logger=LOGGER,
+    )
     try:
         count = 0
-        for reply in api.search_tweets(
-            tweepy_api,
-            query,
-            count=100,
-            result_type='recent',
-            id_state=id_state,
-            logger=LOGGER,
-        ):
-            count += 1
-            if count % 50 == 0 and count > 0:
-                LOGGER.info(f'Processed {count} replies.')
-            yield reply
+        index = 0
+        # Fetch the next page of replies while the current page is processed.
+        for page in util.prefetch(pages):
+            for reply in page:
+                # Replies are returned from newest to oldest.
+                while index < len(tweets) - 1 and tweets[index].id >= reply.id:
+                    index += 1
+                count += 1
+                if count % 50 == 0 and count > 0:
+                    LOGGER.info(f'Processed {count} replies.')
+                yield (tweets[index], reply)
     except tweepy.TweepError:
         # Store the id state on an error and re-raise.
-        REPLIES_PROCESSED[str(tweet.id)] = {
-            'max_id': str(id_state.max_id),
-        }
+        memoize_replies_state(tweets, previous_id, id_state.max_id)
         raise
 
-    # Store that all replies have been processed for Tweet.
-    REPLIES_PROCESSED[str(tweet.id)] = {
-        'max_id': str(api.END_MAX_ID),
-    }
+    # Store that all replies have been processed for the Tweets.
+    memoize_replies_state(tweets, previous_id, api.END_MAX_ID)
 
 
 def media_has_photo(media):
@@ -211,41 +307,59 @@ def media_has_video(media):
     return any(i['type'] == 'video' for i in media)
 
 
-def should_block_media(tweet, **kwds):
-    '''Determine if we should block an account based on tweet media.'''
+def blocked_media_types(**kwds):
+    '''Get the media types which aren't whitelisted.'''
+
+    blocked_types = set()
+    if not kwds.get('whitelist_photo', True):
+        blocked_types.add('photo')
+    if not kwds.get('whitelist_animated_gif', False):
+        blocked_types.add('animated_gif')
+    if not kwds.get('whitelist_video', False):
+        blocked_types.add('video')
+    return frozenset(blocked_types)
 
-    if not hasattr(tweet, 'extended_entities'):
+
+def should_block_media(tweet, blocked_types=None, **kwds):
+    '''
+    Determine if we should block an account based on tweet media.
+
+    :param tweet: Tweet to check the media of.
+    :param blocked_types:
+        (Optional) Media types which aren't whitelisted, from
+        `blocked_media_types`. Calculated from `kwds` if not provided.
+    :param **kwds:
+        Optional keyword-arguments to override media whitelisting.
+    '''
+
+    if blocked_types is None:
+        blocked_types = blocked_media_types(**kwds)
+    if not blocked_types:
+        return False
+
+    entities = getattr(tweet, 'extended_entities', None)
+    if entities is None:
         # No native media, cannot have any videos in replies.
         return False
-    if not 'media' in tweet.extended_entities:
+    media = entities.get('media')
+    if not media:
         # No media key in extended_entities, unexpected but be safe.
         return False
 
-    media = tweet.extended_entities['media']
-    has_photo = media_has_photo(media)
-    has_animated_gif = media_has_animated_gif(media)
-    has_video = media_has_video(media)
-
-    if not kwds.get('whitelist_photo', True) and has_photo:
-        return True
-    elif not kwds.get('whitelist_animated_gif', False) and has_animated_gif:
-        return True
-    elif not kwds.get('whitelist_video', False) and has_video:
-        return True
+    # Single pass over the media, returning on the first blocked type.
+    for item in media:
+        if item['type'] in blocked_types:
+            return True
     return False
 
 
 def photo_mime_type(url):
     '''Extract the photo MIME type.'''
 
-    suffix = os.path.splitext(url)[1]
-    if suffix == '.jpg' or suffix == '.jpeg':
-        return 'image/jpeg'
-    elif suffix == '.gif':
-        return 'image/gif'
-    elif suffix == '.png':
-        return 'image/png'
-    else:
+    suffix = url[url.rfind('.'):].lower()
+    try:
+        return PHOTO_MIME_TYPES[suffix]
+    except KeyError:
         raise ValueError('Unrecognized photo type.')
 
 
@@ -253,18 +367,19 @@ def extract_photo_media_url(media):
     '''Extract the media URL from a media extended entity type for a photo.'''
 
     # Photos store the photo type in the media url.
-    urls = [i['media_url_https'] for i in media]
-    mime_types = [photo_mime_type(url) for url in urls]
+    urls = []
+    mime_types = []
+    for item in media:
+        url = item['media_url_https']
+        urls.append(url)
+        mime_types.append(photo_mime_type(url))
 
     return ','.join(mime_types), ','.join(urls)
 
 
 def is_valid_video_type(content_type):
     '''Determine if the video format is a recognized format.'''
-    return content_type in (
-        'video/quicktime',
-        'video/mp4',
-    )
+    return content_type in VIDEO_TYPES
 
 
 def extract_video_media_url(media):
@@ -273,12 +388,18 @@ def extract_video_media_url(media):
     # Can be a video or animated gif
     # Filter for actual video variants.
     variants = media['video_info']['variants']
-    filtered = [i for i in variants if is_valid_video_type(i['content_type'])]
+    filtered = [i for i in variants if i['content_type'] in VIDEO_TYPES]
     if not filtered:
         raise ValueError(f'Could not get valid video variants, content-type is {variants[0]["content_type"]}.')
 
     # Choose the highest-quality variant.
-    best = max(filtered, key=lambda x: x['bitrate'])
+    best = filtered[0]
+    best_bitrate = best['bitrate']
+    for variant in filtered[1:]:
+        bitrate = variant['bitrate']
+        if bitrate > best_bitrate:
+            best = variant
+            best_bitrate = bitrate
     return (best['content_type'], best['url'])
 
 
@@ -296,76 +417,108 @@ def extract_media_url(tweet):
     return extract_video_media_url(media[0])
 
 
-def block_account(tweepy_api, me, reply, tweet, user, whitelist_users, **kwds):
-    '''Block account if not white-listed.'''
+def memoize_blocked(reply, tweet, user):
+    '''Memoize a blocked replier.'''
+
+    LOGGER.info(f'Blocked replier={user.screen_name}')
+    media_content_type, media_url = extract_media_url(reply)
+    media = reply.extended_entities['media'][0]
+    # Tweepy stores the optional fields in the instance dict, so look them
+    # up directly rather than through getattr with a default.
+    user_attrs = vars(user)
+    reply_attrs = vars(reply)
+    # Very few accounts or replies are withheld, so avoid joining empty lists.
+    user_withheld_countries = user_attrs.get('withheld_in_countries')
+    user_withheld_countries = ','.join(user_withheld_countries) if user_withheld_countries else ''
+    reply_withheld_countries = reply_attrs.get('withheld_in_countries')
+    reply_withheld_countries = ','.join(reply_withheld_countries) if reply_withheld_countries else ''
+    REPLIERS_BLOCKED[user.id] = (
+        # Basic Reply Info
+        user.screen_name,
+        reply.id,
+        # Booleans
+        int(user.default_profile),
+        int(user.default_profile_image),
+        int(user.protected),
+        int(user.verified),
+        # Numbers
+        user.favourites_count,
+        user.followers_count,
+        user.friends_count,
+        user.listed_count,
+        user.statuses_count,
+        # Strings
+        str(user.created_at),
+        user.description or '',
+        user.location or '',
+        user.name,
+        user.url or '',
+        user_withheld_countries,
+        user_attrs.get('withheld_scope', ''),
+        # Basic Tweet Info
+        tweet.id,
+        tweet.user.id,
+        tweet.user.screen_name,
+        # Reply Booleans
+        int(reply.is_quote_status),
+        int(reply_attrs.get('possibly_sensitive', False)),
+        int(reply_attrs.get('withheld_copyright', False)),
+        # Reply Numbers
+        reply_attrs.get('retweet_count', 0),
+        reply_attrs.get('favorite_count', 0),
+        # Reply Strings
+        str(reply.created_at),
+        reply_attrs.get('lang', ''),
+        reply.source,
+        reply_withheld_countries,
+        reply_attrs.get('withheld_scope', ''),
+        # Media Basic Info
+        media['type'],
+        media_content_type,
+        media_url,
+    )
 
-    # Allow repeated requests without incurring API limits.
-    if str(user.id) in REPLIERS_SEEN:
-        LOGGER.info(f'Already blocked replier={user.screen_name}')
-        return
 
-    if whitelist.should_block_user(tweepy_api, me, user, whitelist_users, **kwds):
-        if not getattr(user, 'blocking', False):
-            api.create_block(tweepy_api, user.id)
-
-        # Memoize blocked account.
-        LOGGER.info(f'Blocked replier={user.screen_name}')
-        media_content_type, media_url = extract_media_url(reply)
-        media = reply.extended_entities['media'][0]
-        user_withheld_countries = ','.join(getattr(user, 'withheld_in_countries', []))
-        reply_withheld_countries = ','.join(getattr(reply, 'withheld_in_countries', []))
-        REPLIERS_BLOCKED[str(user.id)] = {
-            # Basic Reply Info
-            'replier_screen_name': user.screen_name,
-            'reply_id': str(reply.id),
-            # Booleans
-            'replier_default_profile': int(user.default_profile),
-            'replier_default_profile_image': int(user.default_profile_image),
-            'replier_protected': int(user.protected),
-            'replier_verified': int(user.verified),
-            # Numbers
-            'replier_favourites_count': user.favourites_count,
-            'replier_repliers_count': user.followers_count,
-            'replier_friends_count': user.friends_count,
-            'replier_listed_count': user.listed_count,
-            'replier_statuses_count': user.statuses_count,
-            # Strings
-            'replier_created_at': str(user.created_at),
-            'replier_description': user.description or '',
-            'replier_location': user.location or '',
-            'replier_name': user.name,
-            'replier_url': user.url or '',
-            'replier_withheld_in_countries': user_withheld_countries,
-            'replier_withheld_scope': getattr(user, 'withheld_scope', ''),
-            # Basic Tweet Info
-            'tweet_id': str(tweet.id),
-            'tweet_author_id': str(tweet.user.id),
-            'tweet_author_screen_name': tweet.user.screen_name,
-            # Reply Booleans
-            'reply_is_quote_status': int(reply.is_quote_status),
-            'reply_possibly_sensitive': int(getattr(reply, 'possibly_sensitive', False)),
-            'reply_withheld_copyright': int(getattr(reply, 'withheld_copyright', False)),
-            # Reply Numbers
-            'reply_retweet_count': getattr(reply, 'retweet_count', 0),
-            'reply_favorite_count': getattr(reply, 'favorite_count', 0),
-            # Reply Strings
-            'reply_created_at': str(reply.created_at),
-            'reply_lang': getattr(reply, 'lang', ''),
-            'reply_source': reply.source,
-            'reply_withheld_in_countries': reply_withheld_countries,
-            'reply_withheld_scope': getattr(reply, 'withheld_scope', ''),
-            # Media Basic Info
-            'media_type': media['type'],
-            'media_content_type': media_content_type,
-            'media_url': media_url,
-        }
+def memoize_seen(user):
+    '''Memoize a seen replier.'''
 
-    # Memoize seen account.
-    REPLIERS_SEEN[str(user.id)] = {
+    REPLIERS_SEEN[user.id] = {
         'screen_name': user.screen_name,
     }
 
 
+def block_account_batch(tweepy_api, me, replies, whitelist_users, **kwds):
+    '''
+    Block the authors of a batch of replies, if not white-listed.
+
+    Block requests for the batch are issued concurrently, rather
+    than waiting on each request in turn.
+
+    :param replies: List of (tweet, reply) pairs.
+    '''
+
+    # Only process the first reply from each unseen user.
+    seen = REPLIERS_SEEN.contains_keys(i.user.id for (_, i) in replies)
+    unseen = {}
+    for (tweet, reply) in replies:
+        user = reply.user
+        if user.id in seen:
+            LOGGER.info(f'Already blocked replier={user.screen_name}')
+        elif user.id not in unseen:
+            unseen[user.id] = (tweet, reply)
+    users = [reply.user for (_, reply) in unseen.values()]
+    users = whitelist.should_block_users(tweepy_api, me, users, whitelist_users, **kwds)
+    blocked_ids = {i.id for i in users}
+    blocked = [(tweet, reply) for (tweet, reply) in unseen.values() if reply.user.id in blocked_ids]
+    user_ids = [i.user.id for (_, i) in blocked if not getattr(i.user, 'blocking', False)]
+    api.create_blocks(tweepy_api, user_ids)
+
+    for (tweet, reply) in blocked:
+        memoize_blocked(reply, tweet, reply.user)
+    for (_, reply) in unseen.values():
+        memoize_seen(reply.user)
+
+
 def block_media_replies(
     account_screen_name,
     whitelist_screen_names=None,
@@ -392,20 +545,42 @@ def block_media_replies(
     api_root = kwds.pop('api_root', None)
     local_rate_limit = kwds.pop('local_rate_limit', None)
     tweepy_api = api.generate_api(timeout, api_root, local_rate_limit)
-    tweepy_api = api.generate_api(timeout)
     me = tweepy_api.me()
     account = tweepy_api.get_user(screen_name=account_screen_name)
-    whitelist = []
+    whitelist_users = []
     if whitelist_screen_names is not None:
-        whitelist = list(api.lookup_users(
+        whitelist_users = list(api.lookup_users(
             tweepy_api,
             screen_names=whitelist_screen_names,
             logger=LOGGER,
         ))
-
-    previous_tweet_id = None
-    for tweet in tweets(tweepy_api, account):
-        for reply in replies(tweepy_api, tweet, previous_tweet_id):
-            if should_block_media(reply, **kwds):
-                block_account(tweepy_api, me, reply, tweet, reply.user, whitelist, **kwds)
-        previous_tweet_id = tweet.id
+        # Fetch friendships with whitelisted accounts once, up front,
+        # and order the whitelist to check the cheapest accounts first.
+        whitelist_users = whitelist.prefetch_whitelist(tweepy_api, whitelist_users)
+
+    blocked_types = blocked_media_types(**kwds)
+    # Load all processed and finished Tweets at once, rather than
+    # querying each Tweet on a resumed run.
+    processed_tweets = set(REPLIES_PROCESSED.keys())
+    finished_tweets = set(REPLIES_PROCESSED.keys_by_column('max_id', api.END_MAX_ID))
+    groups = tweet_groups(tweets(tweepy_api, account), processed_tweets, finished_tweets)
+    for (previous_tweet_id, group) in groups:
+        # Close the search on an error, so the prefetching thread stops
+        # before the error is handled, rather than when it is collected.
+        with contextlib.closing(replies(tweepy_api, group, previous_tweet_id)) as group_replies:
+            count = BATCH_SIZE
+            while count == BATCH_SIZE:
+                # Commit each batch in a single transaction, keeping any
+                # progress made before an error.
+                with REPLIERS_SEEN.transaction(rollback=False):
+                    count = 0
+                    batch = []
+                    try:
+                        for (tweet, reply) in itertools.islice(group_replies, BATCH_SIZE):
+                            count += 1
+                            if should_block_media(reply, blocked_types):
+                                batch.append((tweet, reply))
+                    finally:
+                        # Always process fetched replies, even if fetching more
+                        # failed, since the stored search state has moved past them.
+                        block_account_batch(tweepy_api, me, batch, whitelist_users, **kwds)
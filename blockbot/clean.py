@@ -5,6 +5,7 @@
     Clean all data storage.
 '''
 
+import contextlib
 import os
 
 from . import log
@@ -25,7 +26,12 @@ def clean_logs():
 
 def clean_tables():
     '''Clean existing SQLite data tables.'''
+
     os.unlink(path.db_path())
+    # Remove the write-ahead log and shared-memory files, if present.
+    for suffix in ('-wal', '-shm'):
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path.db_path() + suffix)
 
 
 def clean_all():
@@ -9,6 +9,7 @@
 '''
 
 import atexit
+import contextlib
 import csv
 import collections.abc
 import os
@@ -16,6 +17,7 @@ import sqlite3
 import typing
 
 from . import path
+from . import util
 
 # SQL
 
@@ -40,12 +42,35 @@ def create_table(table, columns, primary_key):
     return f'CREATE TABLE IF NOT EXISTS {table} ({", ".join(column_str)});'
 
 def create_index(table, column, unique):
-    '''Convert an column name into a string to pass to cursor.'''
+    '''
+    Convert an column name into a string to pass to cursor.
+
+    The column may also be a tuple of column names, for a composite
+    index. Including the value columns after the filtered column
+    makes a covering index, so lookups never read the table itself.
+    '''
 
     create = 'CREATE'
     if unique:
         create = f'{create} UNIQUE'
-    return f'{create} INDEX IF NOT EXISTS {column}_index ON {table} ({column});'
+    columns = column
+    if isinstance(column, tuple):
+        columns = ', '.join(column)
+        column = '_'.join(column)
+    # Index names are global to the database, so include the table name.
+    return f'{create} INDEX IF NOT EXISTS {table}_{column}_index ON {table} ({columns});'
+
+def migrate_column(name, column_type, nullable):
+    '''Create an expression to convert a column to a new type.'''
+
+    if column_type == 'INTEGER' and nullable:
+        # Values which aren't integers, such as 'None', become NULL.
+        return (
+            f"CASE WHEN typeof({name}) = 'integer' "
+            f"OR CAST({name} AS INTEGER) || '' = {name} "
+            f"THEN CAST({name} AS INTEGER) END"
+        )
+    return f'CAST({name} AS {column_type})'
 
 def unsafe_select(table, condition, columns='*'):
     '''Create a query string to find a row.'''
@@ -91,6 +116,40 @@ def unsafe_insert_if_not_exists(table, values, columns=None):
 # path: Connection objects for list of open connections.
 CONNECTIONS = {}
 
+# Tuning for the memo tables, applied whenever a connection is opened:
+# a 64 MiB page cache and 1 GiB of memory-mapped I/O keep hot B-tree
+# pages resident, and a write-ahead log avoids a rollback journal per commit.
+# The page size only applies to new databases, and must be set before WAL.
+# We don't use an exclusive locking mode, since each script's daemon
+# shares the same database file.
+PRAGMAS = (
+    'PRAGMA page_size=8192;',
+    'PRAGMA cache_size=-65536;',
+    'PRAGMA journal_mode=WAL;',
+    'PRAGMA synchronous=NORMAL;',
+    'PRAGMA temp_store=MEMORY;',
+    'PRAGMA mmap_size=1073741824;',
+)
+
+# Refresh the query planner statistics, limiting the analysis so it
+# stays cheap on large databases: once when opened, and on close.
+OPEN_OPTIMIZE_PRAGMA = 'PRAGMA optimize=0x10002;'
+CLOSE_OPTIMIZE_PRAGMA = 'PRAGMA optimize;'
+
+# Number of pending writes to buffer before flushing them to the database.
+WRITE_BUFFER_SIZE = 500
+
+# Maximum number of parameters bound to a single statement. Older
+# versions of SQLite only allow up to 999 parameters.
+MAX_PARAMETERS = 512
+
+# Number of compiled statements cached per connection. Every table
+# has several precompiled statements, which must not evict each other.
+STATEMENT_CACHE_SIZE = 256
+
+# Size of the file buffer when exporting to CSV, to write in large blocks.
+CSV_BUFFER_SIZE = 1 << 20
+
 class Connection:
     '''Reference-counted connection object to a backing database.'''
 
@@ -99,6 +158,8 @@ class Connection:
         self._conn = None
         self._cursor = None
         self._open_connections = 0
+        # Collections with buffered writes to flush before a commit.
+        self._buffers = []
 
     def __enter__(self):
         self.open()
@@ -116,8 +177,14 @@ class Connection:
         '''Open connection to database if none exist, and increment open connections.'''
 
         if self._conn is None:
-            self._conn = sqlite3.connect(self._path)
+            self._conn = sqlite3.connect(
+                self._path,
+                cached_statements=STATEMENT_CACHE_SIZE,
+            )
             self._cursor = self._conn.cursor()
+            for pragma in PRAGMAS:
+                self._cursor.execute(pragma)
+            self.optimize(OPEN_OPTIMIZE_PRAGMA)
         self._open_connections += 1
 
     def close(self) -> None:
@@ -125,12 +192,31 @@ class Connection:
 
         if self._conn is not None:
             # Ensure we commit any changes over-eagerly.
+            self.flush()
             self._conn.commit()
             self._open_connections -= 1
         if self._conn is not None and self._open_connections == 0:
+            self.optimize(CLOSE_OPTIMIZE_PRAGMA)
             self._conn.close()
             self._conn = None
             self._cursor = None
+            # Tables must be reopened along with the connection.
+            for buffer in self._buffers:
+                buffer.reset()
+
+    def close_all(self) -> None:
+        '''Close the connection, even if it is still referenced.'''
+
+        while self.is_open():
+            self.close()
+
+    def optimize(self, pragma):
+        '''Refresh the query planner statistics, ignoring any errors.'''
+
+        # This is only an optimization, and must never prevent
+        # the connection from opening or closing.
+        with contextlib.suppress(sqlite3.Error):
+            self._cursor.execute(pragma)
 
     def execute(self, statement, *parameters):
         '''Execute a given statement, with the additional parameters.'''
@@ -139,20 +225,72 @@ class Connection:
             raise RuntimeError('Cannot execute statement after closing connection.')
         return self._cursor.execute(statement, parameters)
 
+    def executemany(self, statement, parameters):
+        '''Execute a given statement once for each set of parameters.'''
+
+        if not self.is_open():
+            raise RuntimeError('Cannot execute statement after closing connection.')
+        return self._cursor.executemany(statement, parameters)
+
+    def register_buffer(self, buffer):
+        '''Register a collection with buffered writes, flushed before each commit.'''
+
+        self._buffers.append(buffer)
+
+    def flush(self):
+        '''Write all buffered changes to the database.'''
+
+        for buffer in self._buffers:
+            buffer.flush()
+
+    def discard(self):
+        '''Discard all buffered changes and cached entries, after a rollback.'''
+
+        for buffer in self._buffers:
+            buffer.discard()
+
     def begin_transaction(self):
         '''Begin SQLite transaction.'''
+        self.flush()
+        # Commit writes made in an implicit transaction, which were
+        # already complete, since SQLite cannot nest transactions.
         if self._conn.in_transaction:
             self.execute('END TRANSACTION;')
-        self.execute('BEGIN TRANSACTION;')
+        # Take the write lock up front, so the transaction cannot fail
+        # when another daemon wrote to the database since it began.
+        self.execute('BEGIN IMMEDIATE TRANSACTION;')
 
     def commit_transaction(self):
         '''Commit SQLite transaction.'''
+        self.flush()
         self.execute('COMMIT;')
 
     def rollback_transaction(self):
         '''Rollback SQLite transaction.'''
+        self.discard()
         self.execute('ROLLBACK;')
 
+    @contextlib.contextmanager
+    def transaction(self, rollback=True):
+        '''
+        Group all statements within the context into a single transaction.
+
+        :param rollback:
+            (Optional) Rollback on an error, otherwise commit any changes
+            made before the error occurred.
+        '''
+
+        self.begin_transaction()
+        try:
+            yield self
+        except BaseException:
+            if rollback:
+                self.rollback_transaction()
+            else:
+                self.commit_transaction()
+            raise
+        self.commit_transaction()
+
     def create_table(self, table, columns, primary_key, indexes=None):
         '''Try to create a new table in the database if it doesn't exist.'''
 
@@ -163,6 +301,34 @@ class Connection:
                 statement = create_index(table, column, unique)
                 self.execute(statement)
 
+    def migrate_table(self, table, columns, primary_key):
+        '''Convert an existing table to the current column types, if they changed.'''
+
+        info = self.execute(f'PRAGMA table_info({table});').fetchall()
+        if not info:
+            return
+        current = {row[1]: row[2] for row in info}
+        if all(current.get(name) == column_type for (name, column_type, _) in columns):
+            return
+        if len(current) != len(columns) or any(name not in current for (name, _, _) in columns):
+            raise ValueError(f'Cannot migrate table {table} with different columns.')
+
+        # SQLite cannot alter the type of a column, so copy the data
+        # into a new table. Use a savepoint, since this might be
+        # called within a transaction.
+        values = ', '.join(migrate_column(*column) for column in columns)
+        self.execute('SAVEPOINT migrate_table;')
+        try:
+            self.execute(f'ALTER TABLE {table} RENAME TO {table}_migrate;')
+            self.execute(create_table(table, columns, primary_key))
+            self.execute(f'INSERT INTO {table} SELECT {values} FROM {table}_migrate;')
+            self.execute(f'DROP TABLE {table}_migrate;')
+        except Exception:
+            self.execute('ROLLBACK TO migrate_table;')
+            self.execute('RELEASE migrate_table;')
+            raise
+        self.execute('RELEASE migrate_table;')
+
     def drop_table(self, table):
         '''Delete (drop) the given table.'''
         self.execute(f'DROP TABLE {table};')
@@ -170,6 +336,40 @@ class Connection:
     def is_open(self) -> bool:
         return self._conn is not None
 
+# CACHE
+
+# Sentinels for cached keys: the key is absent, or present with an unknown value.
+ABSENT = object()
+PRESENT = object()
+
+
+class LruCache:
+    '''Bounded mapping which evicts the least-recently used entries.'''
+
+    def __init__(self, maxsize: int) -> None:
+        self._maxsize = maxsize
+        self._data = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        '''Get an item from the cache, marking it as recently used.'''
+
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        '''Remove all items from the cache.'''
+        self._data.clear()
+
+
 # COLLECTIONS
 
 
@@ -190,6 +390,8 @@ class SqliteDict(collections.abc.MutableMapping):
         columns: typing.List[typing.Tuple[str, str, bool]],
         primary_key: str,
         indexes: typing.Optional[typing.Tuple[str, bool]] = None,
+        cache_size: int = 0,
+        insert_ignore: bool = False,
     ) -> None:
         self._path = dbpath
         self._conn = Connection.new(self._path)
@@ -197,9 +399,40 @@ class SqliteDict(collections.abc.MutableMapping):
         self._columns = columns
         self._primary_key = primary_key
         self._indexes = indexes
+        # Only check the table exists once, rather than before every query.
+        self._opened = False
 
         # Some internal helpers.
         self._column_names =[i[0] for i in columns]
+        self._key_index = self._column_names.index(primary_key)
+        self._value_columns = [i for i in self._column_names if i != primary_key]
+        # Optional in-memory cache of recently used keys.
+        self._cache = None
+        if cache_size > 0:
+            self._cache = LruCache(cache_size)
+        # Rows written but not yet flushed to the database.
+        self._pending = []
+        self._conn.register_buffer(self)
+
+        # Statements are only formatted once, and re-used for every query.
+        params = ['?'] * len(columns)
+        condition = f'{primary_key} = ?'
+        self._replace = unsafe_insert(table, params)
+        self._insert_if_not_exists = unsafe_insert_if_not_exists(table, params)
+        # Statement for setting items: either replace or keep existing rows.
+        self._insert = self._replace
+        if insert_ignore:
+            self._insert = self._insert_if_not_exists
+        # Only select the value columns, since the key is already known.
+        self._select = unsafe_select(table, condition, ', '.join(self._value_columns))
+        self._contains = unsafe_select(table, f'{condition} LIMIT 1', '1')
+        self._delete = unsafe_delete(table, condition)
+        self._select_all = f'SELECT * FROM {table};'
+        self._select_keys = f'SELECT {primary_key} FROM {table};'
+        # Select the key last, so the values can be zipped with their columns.
+        items_columns = ', '.join(self._value_columns + [primary_key])
+        self._select_items = f'SELECT {items_columns} FROM {table};'
+        self._count = f'SELECT COUNT(*) FROM {table};'
 
     # PROPERTIES
 
@@ -229,6 +462,8 @@ class SqliteDict(collections.abc.MutableMapping):
             os.makedirs(os.path.dirname(self._path), exist_ok=True)
         self._conn.open()
 
+        # Convert tables created with older column types.
+        self._conn.migrate_table(self.table, self._columns, self.primary_key)
         # Try to create the table if it doesn't exist, along with indexes.
         self._conn.create_table(
             self.table,
@@ -236,14 +471,60 @@ class SqliteDict(collections.abc.MutableMapping):
             self.primary_key,
             self._indexes,
         )
+        self._opened = True
 
     def close(self) -> None:
         '''Close connection.'''
 
-        if self._conn is not None:
+        if self._opened:
+            self.flush()
             self._conn.close()
+        self._opened = False
         self._conn = None
 
+    def flush(self) -> None:
+        '''Write all buffered rows to the database.'''
+
+        if self._pending:
+            self._conn.executemany(self._insert, self._pending)
+            self._pending.clear()
+
+    def reset(self) -> None:
+        '''Mark the table as closed, after the connection was closed.'''
+        self._opened = False
+
+    def discard(self) -> None:
+        '''Discard all buffered rows, after a rollback.'''
+
+        self._pending.clear()
+        # Cached keys may have only been written to the buffer, or to
+        # rows flushed within the rolled-back transaction.
+        self._cache_clear()
+
+    @contextlib.contextmanager
+    def transaction(self, rollback=True):
+        '''
+        Group all changes within the context into a single transaction.
+
+        All collections with the same backing database share a connection,
+        so this also groups changes to other collections in the database.
+
+        :param rollback:
+            (Optional) Rollback on an error, otherwise commit any changes
+            made before the error occurred.
+
+        .. code-block:: python
+
+            with FOLLOWERS_SEEN.transaction():
+                FOLLOWERS_SEEN['12'] = {'screen_name': 'jack'}
+        '''
+
+        if not self._opened:
+            self.open()
+        # A rollback discards the buffers and caches of every collection.
+        with self._conn.transaction(rollback):
+            yield self
+
     def is_open(self) -> bool:
         '''Check if connection is open.'''
 
@@ -265,19 +546,19 @@ class SqliteDict(collections.abc.MutableMapping):
         '''Serialize backing store to CSV.'''
 
         # Ensure we have an open connection before we do anything.
-        if not self.is_open():
+        if not self._opened:
             self.open()
+        self.flush()
 
-        # Write to file.
-        with open(path, mode) as f:
+        # Write to file. Rows are streamed from the cursor, so only
+        # the file buffer is held in memory.
+        with open(path, mode, buffering=CSV_BUFFER_SIZE) as f:
             writer = csv.writer(f, delimiter=delimiter, quotechar=quotechar)
             # Write the columns.
             if self.columns is not None:
                 writer.writerow(self.columns)
 
-            statement = f'SELECT * FROM {self.table};'
-            for row in self._conn.execute(statement):
-                writer.writerow(row)
+            writer.writerows(self._conn.execute(self._select_all))
 
     def load_csv(
         self,
@@ -289,7 +570,7 @@ class SqliteDict(collections.abc.MutableMapping):
         '''Deserialize backing store from CSV.'''
 
         # Ensure we have an open connection before we do anything.
-        if not self.is_open():
+        if not self._opened:
             self.open()
 
         # Roll into a single transaction. If it fails, we want to revert.
@@ -303,15 +584,22 @@ class SqliteDict(collections.abc.MutableMapping):
                 if columns != self.columns:
                     raise ValueError(f'Unexpected column headings: got {columns}, expected {self.columns}.')
 
-                # Add all values from disk.
+                # NULL values are written as empty fields, so restore them.
+                nullable = [i for (i, column) in enumerate(self._columns) if column[2]]
+
+                def rows():
+                    for row in iterable:
+                        if len(row) != len(self.columns):
+                            raise ValueError('Invalid number of items for row in CSV file.')
+                        for index in nullable:
+                            if row[index] == '':
+                                row[index] = None
+                        yield row
+
+                # Add all values from disk in a single statement.
                 # Use insert which either inserts new entries and overwrites
                 # existing ones.
-                params = ['?'] * len(self.columns)
-                statement = unsafe_insert(self.table, params)
-                for row in iterable:
-                    if len(row) != len(self.columns):
-                        raise ValueError('Invalid number of items for row in CSV file.')
-                    self._conn.execute(statement, *row)
+                self._conn.executemany(self._replace, rows())
 
             # Commit transaction when finished with all data.
             self._conn.commit_transaction()
@@ -319,29 +607,56 @@ class SqliteDict(collections.abc.MutableMapping):
             # Error during parsing, need to rollback and re-raise error.
             self._conn.rollback_transaction()
             raise
+        finally:
+            self._cache_clear()
 
-    # MAGIC
+    # CACHE
 
-    def _torow(self, key, value):
-        '''Convert a dict value to a row.'''
+    def _cache_get(self, key):
+        '''Get the cached entry for a key, or None if not cached.'''
+
+        if self._cache is None:
+            return None
+        return self._cache.get(key)
 
-        copy = {self.primary_key: key, **value}
-        return [copy[i] for i in self.columns]
+    def _cache_set(self, key, entry):
+        '''Set the cached entry for a key: the value, ABSENT, or PRESENT.'''
 
-    def _tovalue(self, value, columns=None):
-        '''Convert a row to a dict result.'''
+        if self._cache is not None:
+            self._cache[key] = entry
 
-        if columns is None:
-            columns = self.columns
+    def _cache_clear(self):
+        '''Clear all cached entries.'''
 
-        result = dict(zip(columns, value))
-        result.pop(self.primary_key, None)
-        return result
+        if self._cache is not None:
+            self._cache.clear()
+
+    # MAGIC
+
+    def _torow(self, key, value):
+        '''
+        Convert a value to a row.
+
+        The value may be a dict, or a tuple with the values for all
+        columns except the primary key, in column order. Tuples are
+        bound directly, without looking up each column by name.
+        '''
+
+        if not isinstance(value, tuple):
+            value = tuple([value[i] for i in self._value_columns])
+        elif len(value) != len(self.columns) - 1:
+            raise ValueError('Invalid number of items for row.')
+        index = self._key_index
+        return value[:index] + (key,) + value[index:]
 
     def keys(self):
         '''Get an iterable yielding all subsequent keys in the dict.'''
 
-        for key, _ in self.items():
+        if not self._opened:
+            self.open()
+        self.flush()
+
+        for (key,) in self._conn.execute(self._select_keys):
             yield key
 
     def values(self):
@@ -353,14 +668,13 @@ class SqliteDict(collections.abc.MutableMapping):
     def items(self):
         '''Get an iterable yielding all subsequent items in the dict.'''
 
-        if not self.is_open():
+        if not self._opened:
             self.open()
+        self.flush()
 
-        statement = f'SELECT * FROM {self.table};'
-        for row in self._conn.execute(statement):
-            value = dict(zip(self.columns, row))
-            key = value.pop(self.primary_key)
-            yield (key, value)
+        columns = self._value_columns
+        for row in self._conn.execute(self._select_items):
+            yield (row[-1], dict(zip(columns, row)))
 
     def get(self, key, default=None):
         '''Get an item from the SQL database, returning default if it's not present.'''
@@ -370,62 +684,158 @@ class SqliteDict(collections.abc.MutableMapping):
         except KeyError:
             return default
 
+    def keys_by_column(self, column, value):
+        '''Get an iterable yielding all keys where the column matches a value.'''
+
+        if not self._opened:
+            self.open()
+        self.flush()
+
+        # NOTE: We don't worry about SQL injection here, since we trust the column names.
+        if column not in self.columns:
+            raise ValueError(f'SqliteDict has no column "{column}".')
+        statement = unsafe_select(self.table, f'{column} = ?', self.primary_key)
+        for (key,) in self._conn.execute(statement, value):
+            yield key
+
+    def get_by_column(self, column, value, default=None):
+        '''
+        Get the first (key, value) item where the column matches a value.
+
+        The column should be indexed, otherwise this scans the table.
+        Returns default if no item matches.
+
+        .. code-block:: python
+
+            ACCOUNTS_PROCESSED.get_by_column('screen_name', 'jack')
+        '''
+
+        if not self._opened:
+            self.open()
+        self.flush()
+
+        # NOTE: We don't worry about SQL injection here, since we trust the column names.
+        if column not in self.columns:
+            raise ValueError(f'SqliteDict has no column "{column}".')
+        statement = unsafe_select(self.table, f'{column} = ? LIMIT 1')
+        row = self._conn.execute(statement, value).fetchone()
+        if row is None:
+            return default
+        value = dict(zip(self.columns, row))
+        key = value.pop(self.primary_key)
+        return (key, value)
+
     def setdefault(self, key, default):
         '''Set a value if not present.'''
 
-        if not self.is_open():
+        if not self._opened:
             self.open()
+        self.flush()
 
-        params = ['?'] * len(self.columns)
-        statement = unsafe_insert_if_not_exists(self.table, params)
-        self._conn.execute(statement, *self._torow(key, default))
+        self._conn.execute(self._insert_if_not_exists, *self._torow(key, default))
+        if self._cache_get(key) is ABSENT:
+            self._cache_set(key, PRESENT)
 
     def __getitem__(self, key):
-        if not self.is_open():
+        entry = self._cache_get(key)
+        if entry is ABSENT:
+            raise KeyError(f'SqliteDict has no key "{key}".')
+        elif isinstance(entry, dict):
+            return dict(entry)
+
+        if not self._opened:
             self.open()
+        self.flush()
 
-        condition = f'{self.primary_key} = ?'
-        statement = unsafe_select(self.table, condition)
-        cursor = self._conn.execute(statement, key)
+        cursor = self._conn.execute(self._select, key)
         value = cursor.fetchone()
         if value is None:
+            self._cache_set(key, ABSENT)
             raise KeyError(f'SqliteDict has no key "{key}".')
-        return self._tovalue(value, self.columns)
+        value = dict(zip(self._value_columns, value))
+        self._cache_set(key, dict(value))
+        return value
 
     def __setitem__(self, key, value):
-        if not self.is_open():
+        if not self._opened:
             self.open()
 
-        params = ['?'] * len(self.columns)
-        statement = unsafe_insert(self.table, params)
-        self._conn.execute(statement, *self._torow(key, value))
+        # Buffer the row, and write rows in bulk.
+        self._pending.append(self._torow(key, value))
+        if len(self._pending) >= WRITE_BUFFER_SIZE:
+            self.flush()
+        # The stored value might differ in type, so only cache the key.
+        self._cache_set(key, PRESENT)
 
     def __delitem__(self, key):
-        if not self.is_open():
+        if not self._opened:
             self.open()
+        self.flush()
 
-        condition = f'{self.primary_key} = ?'
-        statement = unsafe_delete(self.table, condition)
-        self._conn.execute(statement, key)
+        self._conn.execute(self._delete, key)
+        self._cache_set(key, ABSENT)
 
     def __iter__(self):
         return self.keys()
 
+    def contains_keys(self, keys):
+        '''
+        Get the set of keys which are present in the dict.
+
+        Uses a single query per batch of keys, rather than one per key.
+
+        :param keys: Iterable of keys to check.
+        '''
+
+        present = set()
+        missing = []
+        for key in keys:
+            entry = self._cache_get(key)
+            if entry is None:
+                missing.append(key)
+            elif entry is not ABSENT:
+                present.add(key)
+        if not missing:
+            return present
+
+        if not self._opened:
+            self.open()
+        self.flush()
+
+        for chunk in util.chunks(missing, MAX_PARAMETERS):
+            # Pad to a power of two by repeating a key, so only a few
+            # distinct statements are compiled and cached.
+            size = 1 << (len(chunk) - 1).bit_length()
+            parameters = chunk + [chunk[-1]] * (size - len(chunk))
+            params = ', '.join(['?'] * size)
+            condition = f'{self.primary_key} IN ({params})'
+            statement = unsafe_select(self.table, condition, self.primary_key)
+            found = {key for (key,) in self._conn.execute(statement, *parameters)}
+            for key in chunk:
+                self._cache_set(key, PRESENT if key in found else ABSENT)
+            present |= found
+        return present
+
     def __contains__(self, key):
-        if not self.is_open():
+        entry = self._cache_get(key)
+        if entry is not None:
+            return entry is not ABSENT
+
+        if not self._opened:
             self.open()
+        self.flush()
 
-        condition = f'{self.primary_key} = ?'
-        statement = unsafe_select(self.table, condition)
-        cursor = self._conn.execute(statement, key)
-        return cursor.fetchone() is not None
+        cursor = self._conn.execute(self._contains, key)
+        contains = cursor.fetchone() is not None
+        self._cache_set(key, PRESENT if contains else ABSENT)
+        return contains
 
     def __len__(self):
-        if not self.is_open():
+        if not self._opened:
             self.open()
+        self.flush()
 
-        statement = f'SELECT COUNT(*) FROM {self._table};'
-        cursor = self._conn.execute(statement)
+        cursor = self._conn.execute(self._count)
         return cursor.fetchone()[0]
 
 # MANAGED OBJECTS
@@ -436,6 +846,8 @@ def sqlite_dict(
     primary_key: str,
     indexes: typing.Optional[typing.Tuple[str, bool]] = None,
     dbpath: str = path.db_path(),
+    cache_size: int = 0,
+    insert_ignore: bool = False,
 ) -> SqliteDict:
     '''
     Generate dict with SQLite backing store.
@@ -449,12 +861,24 @@ def sqlite_dict(
                 ('screen_name', 'TEXT', False),
                 ('cursor', 'TEXT', True),
             ),
-            # indexes=('screen_name', True),
+            # indexes=(('screen_name', True),),
             primary_key='user_id',
             dbpath=':memory:',
+            # Cache up to 1000 recently-used keys in memory.
+            cache_size=1000,
+            # Keep existing rows when setting items, rather than replacing them.
+            insert_ignore=False,
         )
     '''
 
-    inst = SqliteDict(dbpath, table, columns, primary_key, indexes)
+    inst = SqliteDict(
+        dbpath,
+        table,
+        columns,
+        primary_key,
+        indexes,
+        cache_size,
+        insert_ignore,
+    )
     atexit.register(inst.close)
     return inst
@@ -49,9 +49,11 @@ def get_pid(name):
 def close_database_connections():
     '''Close all open database connections.'''
 
-    # Ensure we don't have any accidentally closed PIDs.
+    # Ensure we don't have any accidentally closed PIDs. SQLite
+    # connections must not be shared across a fork, so close them
+    # even if they're still referenced: tables reopen them lazily.
     for connection in collections.CONNECTIONS.values():
-        connection.close()
+        connection.close_all()
 
 
 def handle_connection_error(sleep_time):
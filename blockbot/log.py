@@ -40,6 +40,12 @@ def override_tweepy_logger(tweepy):
     logger.addHandler(FILE_HANDLER)
 
 
+# The formatter doesn't use thread or process information, so
+# don't look it up for every record.
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+
 os.makedirs(path.log_dir(), exist_ok=True)
 CURRENT_LOG_NAME = log_name()
 CURRENT_LOG_PATH = os.path.join(path.log_dir(), CURRENT_LOG_NAME)
@@ -5,9 +5,11 @@
     High-level path utilities relative to project.
 '''
 
+import functools
 import os
 
 
+@functools.lru_cache(maxsize=1)
 def project_dir():
     '''Get the directory to the project folder.'''
 
@@ -5,17 +5,91 @@
     Utilities for blockbot.
 '''
 
+import concurrent.futures
+import itertools
+import threading
+
+# Sentinel for an exhausted iterator.
+EXHAUSTED = object()
+
 
 def chunks(sequence, step, start_index=0):
     '''
     Yield chunks of size `step` from sequence.
 
+    Sequences (lists, tuples, `array.array`) are sliced directly,
+    without iterating over each element. Any other iterable is
+    consumed lazily, and batched into lists.
+
     :param sequence: Sequence to chunk into smaller subsequences.
     :param step: Chunk size.
     :param start_index: (Optional) Index to start from in sequence.
     '''
 
+    if not hasattr(sequence, '__getitem__') or not hasattr(sequence, '__len__'):
+        yield from iter_chunks(sequence, step, start_index)
+        return
+
     for index in range(start_index, len(sequence), step):
         start_index = index
         end_index = start_index + step
         yield sequence[start_index:end_index]
+
+
+def iter_chunks(iterable, step, start_index=0):
+    '''
+    Yield chunks of size `step` from an arbitrary iterable.
+
+    :param iterable: Iterable to chunk into smaller lists.
+    :param step: Chunk size.
+    :param start_index: (Optional) Number of items to skip in iterable.
+    '''
+
+    iterator = itertools.islice(iterable, start_index, None)
+    while True:
+        chunk = list(itertools.islice(iterator, step))
+        if not chunk:
+            return
+        yield chunk
+
+
+def prefetch(iterable):
+    '''
+    Yield items from an iterable, fetching the next item in the background.
+
+    While the caller processes an item, the next item is already being
+    produced by a worker thread, which hides the latency of iterables
+    that make network requests. The iterable must be safe to advance
+    from another thread.
+
+    Closing the generator early stops the worker from advancing the
+    iterable any further, but waits for an item already being produced,
+    including any rate-limit wait, since a running request cannot be
+    interrupted. The worker never outlives the generator.
+
+    :param iterable: Iterable to prefetch items from.
+    '''
+
+    iterator = iter(iterable)
+    stop = threading.Event()
+
+    def produce():
+        # Never advance the iterator once the caller stopped iterating.
+        if stop.is_set():
+            return EXHAUSTED
+        return next(iterator, EXHAUSTED)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(produce)
+        try:
+            while True:
+                item = future.result()
+                if item is EXHAUSTED:
+                    return
+                future = executor.submit(produce)
+                yield item
+        finally:
+            # Exiting the executor waits for the item in progress, so
+            # the worker cannot advance shared state or hold a rate
+            # limit after the generator is closed.
+            stop.set()
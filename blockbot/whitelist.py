@@ -11,40 +11,181 @@
     2. You are following the account (override with `whitelist_following=False`).
     3. You sent the account a follow request (override with `whitelist_follow_request_sent=False`).
     4. The account follows you (override with `whitelist_friendship=False`).
+    5. The account is you, or is itself whitelisted.
 
     # Warnings
 
     The rate-limiting factor is the number of API calls, which increases
-    exponentially with the number of whitelisted users.
+    exponentially with the number of whitelisted users. Friendships with
+    you are looked up in bulk for large batches of users. The followers
+    and friends of small whitelisted accounts are fetched once and
+    periodically refreshed, but friendships with large whitelisted
+    accounts require an API call per user.
 '''
 
+import time
+import tweepy
+
+from . import api
+
+# Minimum number of users to look up friendships with you in bulk.
+# Bulk lookups cover 100 users, but only allow 15 requests every 15
+# minutes, while single lookups allow 180 requests every 15 minutes.
+FRIENDSHIP_LOOKUP_THRESHOLD = 12
+# Maximum number of followers and friends of a whitelisted account to
+# prefetch. IDs are fetched 5000 per request, so each account uses a
+# single request of each type per refresh. Follower IDs only allow 15
+# requests every 15 minutes, which are also needed to list followers.
+WHITELIST_PREFETCH_LIMIT = 5000
+# Interval, in seconds, to refresh prefetched followers and friends.
+# Follow relationships change slowly, so these may be slightly stale.
+WHITELIST_REFRESH_INTERVAL = 60 * 60
+# Prefetched followers and friends of whitelisted accounts, by ID.
+# Each value is the time the IDs were fetched and the set of IDs,
+# or None if the account could not be prefetched.
+WHITELIST_FRIENDS = {}
+
 
 def has_friendship(tweepy_api, source, target):
     '''Check if there exists a friendship between two users.'''
 
     # Will return two friendships, in arbitrary order. We just want either
     # following or followed_by.
+    # Use IDs, which are never renamed and don't need to be resolved.
     friendship = tweepy_api.show_friendship(
-        source_screen_name=source.screen_name,
-        target_screen_name=target.screen_name
+        source_id=source.id,
+        target_id=target.id,
     )[0]
     return friendship.following or friendship.followed_by
 
 
-def should_block_user(tweepy_api, me, user, whitelist, **kwds):
-    '''Checks if a user is whitelisted..'''
+def whitelist_friend_ids(tweepy_api, user):
+    '''
+    Get the IDs of all followers and friends of a whitelisted account.
+
+    Returns None if the account is too large to prefetch, or if
+    the IDs could not be fetched, such as for protected accounts.
+    '''
+
+    now = time.monotonic()
+    cached = WHITELIST_FRIENDS.get(user.id)
+    if cached is not None and now - cached[0] < WHITELIST_REFRESH_INTERVAL:
+        return cached[1]
+
+    ids = None
+    if user.followers_count + user.friends_count <= WHITELIST_PREFETCH_LIMIT:
+        # Paginate directly, since the `api` wrappers swallow authorization
+        # errors, and partial IDs would whitelist too few accounts.
+        try:
+            ids = set()
+            for method in (tweepy_api.get_follower_ids, tweepy_api.get_friend_ids):
+                for page in api.paginate_cursor(
+                    method,
+                    None,
+                    api.START_CURSOR,
+                    user_id=user.id,
+                    count=5000,
+                ):
+                    ids.update(page)
+        except tweepy.TweepError:
+            # Fallback to looking up friendships for each user.
+            ids = None
+    WHITELIST_FRIENDS[user.id] = (now, ids)
+    return ids
+
+
+def prefetch_whitelist(tweepy_api, whitelist):
+    '''
+    Prefetch the followers and friends of all whitelisted accounts.
+
+    Returns the whitelist ordered so friendship checks stop as early as
+    possible: prefetched accounts first, since checking them is free,
+    then by descending follower count, since larger accounts are more
+    likely to have a friendship with any given user.
+    '''
+
+    def key(user):
+        prefetched = whitelist_friend_ids(tweepy_api, user) is not None
+        return (not prefetched, -user.followers_count)
+
+    return sorted(whitelist, key=key)
+
+
+def has_whitelist_friendship(tweepy_api, user, whitelisted):
+    '''Check if there exists a friendship between a user and a whitelisted account.'''
+
+    ids = whitelist_friend_ids(tweepy_api, whitelisted)
+    if ids is None:
+        return has_friendship(tweepy_api, user, whitelisted)
+    return user.id in ids
+
+
+def friendship_ids(tweepy_api, users):
+    '''Get the IDs of all users with a friendship with you, in bulk.'''
 
+    return {
+        i.id for i in api.lookup_friendships(tweepy_api, [i.id for i in users])
+        if i.is_following or i.is_followed_by
+    }
+
+
+def is_whitelisted_account(me, user, whitelist):
+    '''Check if the user is you or a whitelisted account, without any API calls.'''
+    return user.id == me.id or any(user.id == i.id for i in whitelist)
+
+
+def is_whitelisted_profile(me, user, whitelist, **kwds):
+    '''Check if the user is whitelisted from their profile, without any API calls.'''
+
+    if is_whitelisted_account(me, user, whitelist):
+        # Never block yourself or a whitelisted account.
+        return True
     if kwds.get('whitelist_verified', True) and user.verified:
         # Do not block verified accounts.
-        return False
+        return True
     if kwds.get('whitelist_following', True) and user.following:
         # Do not block accounts if following them.
+        return True
+    # Do not block accounts if you sent a follow request to them.
+    return bool(kwds.get('whitelist_follow_request_sent', True) and user.follow_request_sent)
+
+
+def should_block_user(tweepy_api, me, user, whitelist, friends=None, **kwds):
+    '''
+    Checks if a user is whitelisted..
+
+    :param friends:
+        (Optional) IDs of users with a friendship with you, from
+        `friendship_ids`. Looked up for the user if not provided.
+    '''
+
+    if is_whitelisted_profile(me, user, whitelist, **kwds):
         return False
-    elif kwds.get('whitelist_follow_request_sent', True) and user.follow_request_sent:
-        # Do not block accounts if you sent a follow request to them.
-        return False
-    elif kwds.get('whitelist_friendship', True) and has_friendship(tweepy_api, user, me):
-        # Do not block accounts if you have a friendship with the user.
-        return False
+    if kwds.get('whitelist_friendship', True):
+        if friends is not None:
+            has_friends = user.id in friends
+        else:
+            has_friends = has_friendship(tweepy_api, user, me)
+        if has_friends:
+            # Do not block accounts if you have a friendship with the user.
+            return False
     # Do not block accounts if they have a friendship with whitelisted accounts.
-    return not any(has_friendship(tweepy_api, user, i) for i in whitelist)
+    return not any(has_whitelist_friendship(tweepy_api, user, i) for i in whitelist)
+
+
+def should_block_users(tweepy_api, me, users, whitelist, **kwds):
+    '''
+    Get the users in a batch which are not whitelisted.
+
+    Friendships with you are looked up in bulk for large batches,
+    after excluding users that are whitelisted from their profile.
+    '''
+
+    candidates = [i for i in users if not is_whitelisted_profile(me, i, whitelist, **kwds)]
+    friends = None
+    if kwds.get('whitelist_friendship', True) and len(candidates) >= FRIENDSHIP_LOOKUP_THRESHOLD:
+        friends = friendship_ids(tweepy_api, candidates)
+    return [
+        i for i in candidates
+        if should_block_user(tweepy_api, me, i, whitelist, friends, **kwds)
+    ]
@@ -0,0 +1,162 @@
+'''
+    block_media_replies_test
+    ========================
+
+    Tests for grouping Tweets and storing the reply search state.
+'''
+
+import importlib
+import types
+import unittest
+import unittest.mock
+
+import tweepy
+
+from blockbot import api
+from blockbot import collections
+
+# The package exports a function with the same name as the module.
+replies_module = importlib.import_module('blockbot.block_media_replies')
+
+
+def tweet(tweet_id):
+    '''Create a fake Tweet.'''
+    return types.SimpleNamespace(id=tweet_id)
+
+
+def timeline(*tweet_ids, error=False):
+    '''Yield fake Tweets from newest to oldest, optionally raising an error.'''
+
+    for tweet_id in tweet_ids:
+        yield tweet(tweet_id)
+    if error:
+        raise tweepy.TweepError('Failed to send request.')
+
+
+def groups(iterable, processed=(), finished=()):
+    '''Get the Tweet groups as Tweet IDs.'''
+
+    return [
+        (previous_id, [i.id for i in group])
+        for (previous_id, group) in replies_module.tweet_groups(
+            iterable,
+            set(processed),
+            set(finished),
+        )
+    ]
+
+
+class TweetGroupsTest(unittest.TestCase):
+    '''Tests for grouping consecutive Tweets into a single search.'''
+
+    def test_complete_group(self):
+        size = replies_module.SEARCH_GROUP_SIZE
+        ids = list(range(100, 100 - size, -1))
+        self.assertEqual(groups(timeline(*ids)), [(None, ids)])
+
+    def test_partial_group(self):
+        size = replies_module.SEARCH_GROUP_SIZE
+        ids = list(range(100, 100 - size - 2, -1))
+        self.assertEqual(groups(timeline(*ids)), [
+            (None, ids[:size]),
+            (ids[size - 1], ids[size:]),
+        ])
+        self.assertEqual(groups(timeline()), [])
+
+    def test_processed_tweets(self):
+        ids = list(range(20, 0, -1))
+        processed = {15, 10, 3}
+        finished = {10}
+        self.assertEqual(groups(timeline(*ids), processed, finished), [
+            (None, [20, 19, 18, 17, 16]),
+            # Partially processed Tweets are searched alone.
+            (16, [15]),
+            (15, [14, 13, 12, 11]),
+            # Finished Tweets are skipped, but bound the next search.
+            (10, [9, 8, 7, 6, 5]),
+            (5, [4]),
+            (4, [3]),
+            (3, [2, 1]),
+        ])
+
+    def test_finished_tweets(self):
+        ids = [30, 20, 10]
+        self.assertEqual(groups(timeline(*ids), ids, ids), [])
+        self.assertEqual(groups(timeline(*ids), [30], [30]), [(30, [20, 10])])
+
+    def test_error(self):
+        iterator = replies_module.tweet_groups(timeline(30, 20, 10, error=True), set(), set())
+        # The Tweets fetched before the error are still searched.
+        self.assertEqual([i.id for i in next(iterator)[1]], [30, 20, 10])
+        with self.assertRaises(tweepy.TweepError):
+            next(iterator)
+
+    def test_error_after_group(self):
+        size = replies_module.SEARCH_GROUP_SIZE
+        ids = list(range(100, 100 - size - 1, -1))
+        iterator = replies_module.tweet_groups(timeline(*ids, error=True), set(), set())
+        self.assertEqual([i.id for i in next(iterator)[1]], ids[:size])
+        (previous_id, group) = next(iterator)
+        self.assertEqual((previous_id, [i.id for i in group]), (ids[size - 1], ids[size:]))
+        with self.assertRaises(tweepy.TweepError):
+            next(iterator)
+
+
+class MemoizeRepliesStateTest(unittest.TestCase):
+    '''Tests for storing the search state of each Tweet in a group.'''
+
+    def setUp(self):
+        self.processed = collections.sqlite_dict(
+            table='block_media_replies_test_processed_replies',
+            columns=(
+                ('tweet_id', 'INTEGER', False),
+                ('max_id', 'INTEGER', True),
+            ),
+            primary_key='tweet_id',
+            dbpath=':memory:',
+        )
+        patcher = unittest.mock.patch.object(replies_module, 'REPLIES_PROCESSED', self.processed)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        collections.Connection.new(':memory:').close_all()
+
+    def memoize(self, max_id, previous_id=None, ids=(100, 80, 60)):
+        '''Memoize the state, and get the stored max ID for each Tweet.'''
+
+        replies_module.memoize_replies_state([tweet(i) for i in ids], previous_id, max_id)
+        return {key: value['max_id'] for (key, value) in self.processed.items()}
+
+    def test_not_started(self):
+        self.assertEqual(self.memoize(api.START_MAX_ID), {})
+
+    def test_finished(self):
+        self.assertEqual(self.memoize(api.END_MAX_ID), {100: 0, 80: 0, 60: 0})
+
+    def test_below_all(self):
+        # All replies newer than the oldest Tweet were processed.
+        self.assertEqual(self.memoize(50), {100: 0, 80: 0, 60: 0})
+
+    def test_inside_ranges(self):
+        # Replies to a Tweet are newer than it, and older than the next Tweet.
+        self.assertEqual(self.memoize(150), {100: 150})
+        self.assertEqual(self.memoize(90), {100: 0, 80: 90})
+        self.assertEqual(self.memoize(70), {100: 0, 80: 0, 60: 70})
+
+    def test_tweet_boundaries(self):
+        # Reaching a Tweet's ID finishes it, but doesn't start the next.
+        self.assertEqual(self.memoize(100), {100: 0})
+        self.assertEqual(self.memoize(80), {100: 0, 80: 0})
+        self.assertEqual(self.memoize(60), {100: 0, 80: 0, 60: 0})
+
+    def test_previous_id(self):
+        # The newest Tweet's range ends at the previous Tweet.
+        self.assertEqual(self.memoize(130, previous_id=120), {})
+        self.assertEqual(self.memoize(120, previous_id=120), {})
+        self.assertEqual(self.memoize(110, previous_id=120), {100: 110})
+        self.assertEqual(self.memoize(90, previous_id=120), {100: 0, 80: 90})
+
+
+if __name__ == '__main__':
+    unittest.main()
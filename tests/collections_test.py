@@ -0,0 +1,154 @@
+'''
+    collections_test
+    ================
+
+    Tests for the SQLite-backed collections.
+'''
+
+import os
+import tempfile
+import unittest
+
+from blockbot import collections
+
+COLUMNS = (
+    ('user_id', 'INTEGER', False),
+    ('screen_name', 'TEXT', False),
+)
+
+
+def new_dict(table, cache_size=0):
+    '''Create an in-memory dict for a table.'''
+
+    return collections.sqlite_dict(
+        table=table,
+        columns=COLUMNS,
+        primary_key='user_id',
+        dbpath=':memory:',
+        cache_size=cache_size,
+    )
+
+
+class SqliteDictTest(unittest.TestCase):
+    '''Tests for buffering, transactions, and migrations.'''
+
+    def tearDown(self):
+        # Discard the in-memory database between tests.
+        collections.Connection.new(':memory:').close_all()
+
+    def test_buffered_writes(self):
+        for cache_size in (0, 100):
+            table = f'buffered_{cache_size}'
+            seen = new_dict(table, cache_size)
+            seen[1] = {'screen_name': 'jack'}
+            seen[2] = {'screen_name': 'twitter'}
+            self.assertEqual(len(seen._pending), 2)
+
+            self.assertIn(1, seen)
+            self.assertNotIn(3, seen)
+            self.assertEqual(seen.get(2), {'screen_name': 'twitter'})
+            self.assertIsNone(seen.get(3))
+            self.assertEqual(seen.contains_keys([1, 2, 3]), {1, 2})
+            self.assertEqual(len(seen), 2)
+
+    def test_rollback(self):
+        first = new_dict('rollback_first', cache_size=1000)
+        second = new_dict('rollback_second', cache_size=1000)
+        second[10000] = {'screen_name': 'jack'}
+        second.flush()
+
+        with self.assertRaises(KeyError):
+            with first.transaction():
+                first[1] = {'screen_name': 'twitter'}
+                # Fill the buffer, so the rows are flushed mid-transaction
+                # and only the first table has buffered rows.
+                for index in range(collections.WRITE_BUFFER_SIZE):
+                    second[index] = {'screen_name': str(index)}
+                self.assertEqual(second._pending, [])
+                raise KeyError('failed')
+
+        # Both the buffered and flushed rows, and their cached keys, are gone.
+        self.assertEqual(first._pending, [])
+        self.assertEqual(second._pending, [])
+        self.assertNotIn(1, first)
+        self.assertNotIn(5, second)
+        self.assertIsNone(second.get(5))
+        self.assertEqual(len(first), 0)
+        self.assertEqual(len(second), 1)
+        self.assertEqual(second[10000], {'screen_name': 'jack'})
+
+    def test_commit_on_error(self):
+        seen = new_dict('commit_on_error', cache_size=1000)
+        with self.assertRaises(KeyError):
+            with seen.transaction(rollback=False):
+                seen[1] = {'screen_name': 'jack'}
+                seen[2] = {'screen_name': 'twitter'}
+                raise KeyError('failed')
+
+        self.assertEqual(seen._pending, [])
+        self.assertEqual(len(seen), 2)
+        self.assertEqual(seen.get(1), {'screen_name': 'jack'})
+
+    def test_migrate_table(self):
+        table = 'migrate'
+        connection = collections.Connection.new(':memory:')
+        connection.open()
+        old_columns = (
+            ('tweet_id', 'TEXT', False),
+            ('max_id', 'TEXT', True),
+        )
+        connection.create_table(table, old_columns, 'tweet_id')
+        statement = collections.unsafe_insert(table, ['?', '?'])
+        connection.executemany(statement, [
+            ('1', '5'),
+            ('2', 'None'),
+            ('3', None),
+        ])
+
+        processed = collections.sqlite_dict(
+            table=table,
+            columns=(
+                ('tweet_id', 'INTEGER', False),
+                ('max_id', 'INTEGER', True),
+            ),
+            primary_key='tweet_id',
+            dbpath=':memory:',
+        )
+        self.assertEqual(processed[1], {'max_id': 5})
+        self.assertEqual(processed[2], {'max_id': None})
+        self.assertEqual(processed[3], {'max_id': None})
+        self.assertEqual(sorted(processed.keys()), [1, 2, 3])
+        types = connection.execute(f'SELECT typeof(tweet_id), typeof(max_id) FROM {table};')
+        self.assertEqual(sorted(types.fetchall()), [
+            ('integer', 'integer'),
+            ('integer', 'null'),
+            ('integer', 'null'),
+        ])
+
+    def test_csv_nulls(self):
+        processed = collections.sqlite_dict(
+            table='csv_nulls',
+            columns=(
+                ('tweet_id', 'INTEGER', False),
+                ('max_id', 'INTEGER', True),
+                ('screen_name', 'TEXT', False),
+            ),
+            primary_key='tweet_id',
+            dbpath=':memory:',
+        )
+        processed[1] = {'max_id': None, 'screen_name': ''}
+        processed[2] = {'max_id': 5, 'screen_name': 'jack'}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'csv_nulls.csv')
+            processed.to_csv(path)
+            del processed[1]
+            del processed[2]
+            processed.load_csv(path)
+
+        # Empty fields are only NULL in nullable columns.
+        self.assertEqual(processed[1], {'max_id': None, 'screen_name': ''})
+        self.assertEqual(processed[2], {'max_id': 5, 'screen_name': 'jack'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+'''
+    util_test
+    =========
+
+    Tests for the blockbot utilities.
+'''
+
+import threading
+import time
+import unittest
+
+from blockbot import util
+
+
+class PrefetchTest(unittest.TestCase):
+    '''Tests for prefetching items on a background thread.'''
+
+    def test_items(self):
+        self.assertEqual(list(util.prefetch(range(5))), [0, 1, 2, 3, 4])
+        self.assertEqual(list(util.prefetch([])), [])
+
+    def test_error(self):
+        def items():
+            yield 1
+            raise ValueError('failed')
+
+        iterator = util.prefetch(items())
+        self.assertEqual(next(iterator), 1)
+        with self.assertRaises(ValueError):
+            next(iterator)
+
+    def test_close(self):
+        produced = []
+        started = threading.Event()
+
+        def items():
+            for index in range(10):
+                if index == 1:
+                    started.set()
+                    time.sleep(0.2)
+                produced.append(index)
+                yield index
+
+        threads = threading.active_count()
+        iterator = util.prefetch(items())
+        self.assertEqual(next(iterator), 0)
+        started.wait()
+        # Closing waits for the item in progress, and then stops.
+        iterator.close()
+        self.assertEqual(produced, [0, 1])
+        self.assertEqual(threading.active_count(), threads)
+        time.sleep(0.05)
+        self.assertEqual(produced, [0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()